@@ -0,0 +1,31 @@
+"""Add lookup indexes
+
+Revision ID: 3c1f0d2a9b7e
+Revises: 7955e39062da
+Create Date: 2026-10-18 10:12:41.208315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0d2a9b7e'
+down_revision = '7955e39062da'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_file_folder_id_name', 'file', ['folder_id', 'name'], unique=False)
+    op.create_index('ix_fabric_data_file_id_location_id', 'fabric_data', ['file_id', 'location_id'], unique=False)
+    op.create_index('ix_kml_data_file_id_location_id', 'kml_data', ['file_id', 'location_id'], unique=False)
+    op.create_index('ix_vector_tiles_mbtiles_id_zoom_level_tile_column_tile_row', 'vector_tiles',
+                    ['mbtiles_id', 'zoom_level', 'tile_column', 'tile_row'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_vector_tiles_mbtiles_id_zoom_level_tile_column_tile_row', table_name='vector_tiles')
+    op.drop_index('ix_kml_data_file_id_location_id', table_name='kml_data')
+    op.drop_index('ix_fabric_data_file_id_location_id', table_name='fabric_data')
+    op.drop_index('ix_file_folder_id_name', table_name='file')
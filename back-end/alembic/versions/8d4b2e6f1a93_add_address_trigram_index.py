@@ -0,0 +1,26 @@
+"""Add address trigram index
+
+Revision ID: 8d4b2e6f1a93
+Revises: 3c1f0d2a9b7e
+Create Date: 2026-10-18 11:03:17.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4b2e6f1a93'
+down_revision = '3c1f0d2a9b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_fabric_data_address_primary_trgm', 'fabric_data', ['address_primary'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'address_primary': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_fabric_data_address_primary_trgm', table_name='fabric_data')
@@ -0,0 +1,45 @@
+"""Add staged blobs
+
+Revision ID: a9d2e4f6b8c1
+Revises: f3a7c1e9d5b2
+Create Date: 2026-10-19 10:12:37.604211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d2e4f6b8c1'
+down_revision = 'f3a7c1e9d5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('staged_blob',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_staged_blob_owner_id', 'staged_blob', ['owner_id'], unique=False)
+    op.create_index('ix_staged_blob_updated_at', 'staged_blob', ['updated_at'], unique=False)
+    op.create_table('staged_blob_chunk',
+    sa.Column('blob_id', sa.String(length=32), nullable=False),
+    sa.Column('byte_offset', sa.BigInteger(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['blob_id'], ['staged_blob.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('blob_id', 'byte_offset')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('staged_blob_chunk')
+    op.drop_index('ix_staged_blob_updated_at', table_name='staged_blob')
+    op.drop_index('ix_staged_blob_owner_id', table_name='staged_blob')
+    op.drop_table('staged_blob')
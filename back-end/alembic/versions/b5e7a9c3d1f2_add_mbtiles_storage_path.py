@@ -0,0 +1,24 @@
+"""Add mbtiles storage path
+
+Revision ID: b5e7a9c3d1f2
+Revises: 8d4b2e6f1a93
+Create Date: 2026-10-18 13:26:05.117842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e7a9c3d1f2'
+down_revision = '8d4b2e6f1a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mbtiles', sa.Column('storage_path', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('mbtiles', 'storage_path')
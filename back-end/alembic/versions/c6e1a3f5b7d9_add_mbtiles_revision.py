@@ -0,0 +1,24 @@
+"""Add mbtiles revision
+
+Revision ID: c6e1a3f5b7d9
+Revises: a9d2e4f6b8c1
+Create Date: 2026-10-19 14:41:52.308716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e1a3f5b7d9'
+down_revision = 'a9d2e4f6b8c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mbtiles', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('mbtiles', 'revision')
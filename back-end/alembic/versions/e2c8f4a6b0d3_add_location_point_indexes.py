@@ -0,0 +1,29 @@
+"""Add location point indexes
+
+Revision ID: e2c8f4a6b0d3
+Revises: b5e7a9c3d1f2
+Create Date: 2026-10-18 15:21:44.308115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c8f4a6b0d3'
+down_revision = 'b5e7a9c3d1f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+    op.create_index('ix_fabric_data_location_point', 'fabric_data',
+                    [sa.text('ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)')], unique=False, postgresql_using='gist')
+    op.create_index('ix_kml_data_location_point', 'kml_data',
+                    [sa.text('ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)')], unique=False, postgresql_using='gist')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_kml_data_location_point', table_name='kml_data')
+    op.drop_index('ix_fabric_data_location_point', table_name='fabric_data')
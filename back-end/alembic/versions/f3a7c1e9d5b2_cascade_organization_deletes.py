@@ -0,0 +1,45 @@
+"""Cascade organization deletes in the database
+
+Revision ID: f3a7c1e9d5b2
+Revises: e2c8f4a6b0d3
+Create Date: 2026-10-18 17:02:13.518420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c1e9d5b2'
+down_revision = 'e2c8f4a6b0d3'
+branch_labels = None
+depends_on = None
+
+
+# (table, ondelete) of foreign keys to organization.id created without an ON DELETE action
+ORGANIZATION_FOREIGN_KEYS = [
+    ('tower', 'CASCADE'),
+    ('celerytaskinfo', 'CASCADE'),
+    ('user', 'SET NULL'),
+]
+
+
+def upgrade() -> None:
+    for table, ondelete in ORGANIZATION_FOREIGN_KEYS:
+        op.drop_constraint(f'{table}_organization_id_fkey', table, type_='foreignkey')
+        op.create_foreign_key(f'{table}_organization_id_fkey', table, 'organization',
+                              ['organization_id'], ['id'], ondelete=ondelete)
+
+    # Cascading file and editfile deletes look up their links by these columns
+    op.create_index('ix_file_editfile_link_file_id', 'file_editfile_link', ['file_id'], unique=False)
+    op.create_index('ix_file_editfile_link_editfile_id', 'file_editfile_link', ['editfile_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_file_editfile_link_editfile_id', table_name='file_editfile_link')
+    op.drop_index('ix_file_editfile_link_file_id', table_name='file_editfile_link')
+
+    for table, _ in ORGANIZATION_FOREIGN_KEYS:
+        op.drop_constraint(f'{table}_organization_id_fkey', table, type_='foreignkey')
+        op.create_foreign_key(f'{table}_organization_id_fkey', table, 'organization',
+                              ['organization_id'], ['id'])
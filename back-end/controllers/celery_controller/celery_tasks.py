@@ -1,27 +1,35 @@
 import logging, subprocess, os, json, uuid, cProfile, base64
 from controllers.celery_controller.celery_config import celery
 from controllers.database_controller import user_ops, fabric_ops, kml_ops, mbtiles_ops, file_ops, folder_ops, vt_ops, editfile_ops, file_editfile_link_ops, organization_ops
-from database.models import file, kml_data, editfile
+from database.models import file, kml_data, editfile, folder, organization
 from database.sessions import Session, ScopedSession
 from controllers.database_controller.tower_ops import get_tower_with_towername
 from controllers.database_controller.rasterdata_ops import create_rasterdata
-from controllers.signalserver_controller.rasterprocessing import read_rasterkmz, filter_image_by_loss, load_loss_to_color_mapping, generate_transparent_image
+from controllers.signalserver_controller.rasterprocessing import SignalServerRaster
 from flask import jsonify
 from datetime import datetime
 from utils.namingschemes import DATETIME_FORMAT, EXPORT_CSV_NAME_TEMPLATE
 from utils.logger_config import logger
-from utils.wireless_form2args import wireless_raster_file_format, wireless_vector_file_format
-from controllers.signalserver_controller.raster2vector import smooth_edges
+from utils.local_cache import publish_invalidation
+from controllers.database_controller.staged_blob_ops import read_staged_blob, discard_staged_blobs, prune_staged_blobs
+from controllers.database_controller.tile_store import prune_tilesets
+from utils.wireless_form2args import wireless_raster_file_format
+from controllers.signalserver_controller.raster2vector import vectorize_raster, coverage_to_kml
 from sqlalchemy.exc import SQLAlchemyError
+from utils.settings import RASTER_SMOOTHING_ITERATIONS, RASTER_SMOOTHING_KERNEL_RADIUS
+
+def tiling_progress(task):
+    # Reports tippecanoe's progress through the task's result backend state
+    return lambda percent: task.update_state(state='PROGRESS', meta={'stage': 'tiling', 'progress': round(percent, 1)})
 
 @celery.task(bind=True, autoretry_for=(Exception,), retry_backoff=True)
 def add_files_to_folder(self, folderid, file_contents):
     logger.debug(f"folder id in add files to folder is {folderid}")
     try:
         session = Session()
-        for filename, content, metadata_json in file_contents:
+        for filename, blob_ref, metadata_json in file_contents:
             metadata = json.loads(metadata_json)
-            content_bytes = base64.b64decode(content)
+            content_bytes = read_staged_blob(blob_ref, session)
             if (filename.endswith('.csv')):
                 fileVal = file_ops.create_file(filename=filename, content=content_bytes, folderid=folderid, filetype='fabric', session=session)
             elif (filename.endswith('.kml') or filename.endswith('.geojson')):
@@ -34,7 +42,10 @@ def add_files_to_folder(self, folderid, file_contents):
 
                 fileVal = file_ops.create_file(filename=filename, content=content_bytes, folderid=folderid, filetype=networkType, maxDownloadSpeed=downloadSpeed, maxUploadSpeed=uploadSpeed, techType=techType, latency=latency, category=category, session=session)
 
+        # The staged files go in the same transaction as the files made from them
+        discard_staged_blobs([blob_ref for _, blob_ref, _ in file_contents], session)
         session.commit()
+        prune_staged_blobs()
         return folderid
     except Exception as e:
         session.rollback()  # Rollback any changes if there's an exception
@@ -78,43 +89,19 @@ def process_data(self, folderid, operation):
                 session.query(kml_data).filter(kml_data.file_id == file.id).delete()
             session.commit()  # Commit the deletions
 
-        for file in coverage_files:
-            if file.computed:
-                if not recompute_coverage:
-                    continue
-            
-            downloadSpeed = file.maxDownloadSpeed
-            uploadSpeed = file.maxUploadSpeed
-            techType = file.techType
-            networkType = file.type
-            latency = file.latency
-            category = file.category
-            
-
-            if networkType.strip().lower() == "wired": 
-                networkType = 0
-            else: 
-                networkType = 1
-
-            task = kml_ops.add_network_data(folderid, file.id, downloadSpeed, uploadSpeed, techType, networkType, latency, category, session)
-
+        pending_coverage_files = [file for file in coverage_files if recompute_coverage or not file.computed]
+        # All pending coverage files are matched against the fabric in one spatial index query
+        if not kml_ops.add_network_data_batch(folderid, pending_coverage_files, session):
+            raise ValueError(f"Could not store the coverage of folder {folderid}")
+        for file in pending_coverage_files:
             file.computed = True
         
-        geojson_array = []
-        # This is a temporary solution, we should try optimize to use tile-join
-        all_kmls = file_ops.get_files_with_postfix(folderid, '.kml', session)
-        for kml_f in all_kmls:
-            geojson_array.append(vt_ops.read_kml(kml_f.id, session))
-        
-        all_geojsons = file_ops.get_files_with_postfix(folderid, '.geojson', session)
-        for geojson_f in all_geojsons:
-            geojson_array.append(vt_ops.read_geojson(geojson_f.id, session))
-        
+        # The coverage rows of every file, their computed flags and the tileset removal are committed together
         mbtiles_ops.delete_mbtiles(folderid, session)
         session.commit()
         logger.info("finished coverage points computation, now creating vector tiles")
         
-        vt_ops.create_tiles(geojson_array, folderid, session)
+        vt_ops.create_tiles(folderid, session, tiling_progress(self))
         
         
         session.close()
@@ -129,14 +116,10 @@ def process_data(self, folderid, operation):
 def async_delete_files(self, file_ids, editfile_ids):
     session = Session()
     try:
-        
-        for fileid in file_ids:
-            file_ops.delete_file(fileid, session)
-        
-        for editfileid in editfile_ids:
-            editfile_ops.delete_editfile(editfileid, session)
-
+        file_ops.delete_files(file_ids, session)
+        editfile_ops.delete_editfiles(editfile_ids, session)
         session.commit()
+        fabric_ops.delete_fabric_artifacts(file_ids)
 
 
     except SQLAlchemyError as e:
@@ -185,17 +168,7 @@ def toggle_tiles(self, markers, folderid, polygonfeatures):
         else:
             raise Exception('No folder for the user')
         
-        geojson_data = []
-        all_kmls = file_ops.get_files_with_postfix(user_folder.id, '.kml', session)
-        for kml_f in all_kmls:
-            geojson_data.append(vt_ops.read_kml(kml_f.id, session))
-        
-        all_geojsons = file_ops.get_files_with_postfix(folderid=user_folder.id, postfix='.geojson', session=session)
-        for geojson_f in all_geojsons:
-            geojson_data.append(vt_ops.read_geojson(geojson_f.id, session))
-
-        mbtiles_ops.delete_mbtiles(user_folder.id, session)
-        vt_ops.create_tiles(geojson_data, user_folder.id, session)
+        vt_ops.retile_edited_region(user_folder.id, polygonfeatures, session, tiling_progress(self))
         if user_folder.type == 'export':
             existing_csvs = file_ops.get_files_by_type(folderid=user_folder.id, filetype='export', session=session)
             for csv_file in existing_csvs:
@@ -224,7 +197,7 @@ def toggle_tiles(self, markers, folderid, polygonfeatures):
 
 
 @celery.task(bind=True, autoretry_for=(Exception,), retry_backoff=True)
-def async_folder_copy_for_export(self, folderid, serialized_csv, brandname, deadline):
+def async_folder_copy_for_export(self, folderid, csv_ref, brandname, deadline):
     try:
         session = Session()
         
@@ -233,10 +206,10 @@ def async_folder_copy_for_export(self, folderid, serialized_csv, brandname, dead
 
         csv_name = EXPORT_CSV_NAME_TEMPLATE.format(brand_name=brandname, deadline=deadline)
 
-        original_folder = folder_ops.get_folder_with_id(folderid=folderid, session=session)
-        new_folder = original_folder.copy(name=newfolder_name, type='export', deadline=deadline, export=True, session=session)
-        csv_file = file_ops.create_file(filename=csv_name, content=serialized_csv.encode('utf-8'), folderid=new_folder.id, filetype='export', session=session)
+        new_folder = folder_ops.copy_folder(folderid, session, name=newfolder_name, type='export', deadline=deadline, export=True)
+        csv_file = file_ops.create_file(filename=csv_name, content=read_staged_blob(csv_ref, session), folderid=new_folder.id, filetype='export', session=session)
         session.add(csv_file)
+        discard_staged_blobs([csv_ref], session)
         session.commit()
     except Exception as e:
         session.rollback()  # Rollback any changes if there's an exception
@@ -250,8 +223,7 @@ def async_folder_copy_for_import(self, folderid, deadline):
         session = Session()
         newfolder_name = f"Filing for Deadline {deadline}"
 
-        original_folder = folder_ops.get_folder_with_id(folderid=folderid, session=session)
-        new_folder = original_folder.copy(name=newfolder_name, type='upload', deadline=deadline, export=False, session=session)
+        new_folder = folder_ops.copy_folder(folderid, session, name=newfolder_name, type='upload', deadline=deadline, export=False)
         session.commit()
         return new_folder.id
     except Exception as e:
@@ -264,9 +236,12 @@ def async_folder_copy_for_import(self, folderid, deadline):
 def async_folder_delete(self, folderid):
     try:
         session = Session()
-        folder_to_delete = folder_ops.get_folder_with_id(folderid=folderid, session=session)
-        session.delete(folder_to_delete)
+        # Files, fabric and coverage rows, tilesets and edits go with the folder through ON DELETE CASCADE
+        session.query(folder).filter(folder.id == folderid).delete(synchronize_session=False)
         session.commit()
+        publish_invalidation('folder', folderid)
+        prune_tilesets()
+        fabric_ops.prune_fabric_artifacts()
     except Exception as e:
         session.rollback()  # Rollback any changes if there's an exception
         raise e
@@ -283,33 +258,22 @@ def run_signalserver(self, command, outfile_name, tower_id, data):
         if result.stderr:
             print("SignalServer stderr:", result.stderr.decode())
         
-        bbox = read_rasterkmz(outfile_name + '.kmz')
-        filter_image_by_loss(outfile_name + '.png', int(data['floorLossRate']), outfile_name + '.lcf', outfile_name + '.png')
-        with open(outfile_name + '.png', 'rb') as img_file:
-            img_data = img_file.read()
-
-        transparent_image_name = outfile_name + '-transparent' '.png'
-        logger.debug("Generating trans image")
-        generate_transparent_image(outfile_name + '.png', transparent_image_name)
-        with open(transparent_image_name, 'rb') as transparent_img_file:
-            transparent_img_data = transparent_img_file.read()
-        logger.debug("Generated trans image")
-        loss_color_mapping = load_loss_to_color_mapping(outfile_name + '.lcf')
+        raster = SignalServerRaster(outfile_name, int(data['floorLossRate'])).process()
+        logger.debug("Processed SignalServer raster")
         # Assume we have some way to get raster data after running the command
         raster_data_val = create_rasterdata(tower_id=tower_id, 
-                                            image_data=img_data,
-                                            transparent_image_data=transparent_img_data,
-                                            loss_color_mapping=loss_color_mapping,
-                                            nbound=bbox['nbound'],
-                                            sbound=bbox['sbound'],
-                                            ebound=bbox['ebound'],
-                                            wbound=bbox['wbound'],
+                                            image_data=raster.image_data,
+                                            transparent_image_data=raster.transparent_image_data,
+                                            loss_color_mapping=raster.loss_color_mapping,
+                                            nbound=raster.bounds['nbound'],
+                                            sbound=raster.bounds['sbound'],
+                                            ebound=raster.bounds['ebound'],
+                                            wbound=raster.bounds['wbound'],
                                             session=session)
        
 
         for f_extension in wireless_raster_file_format:
             os.remove(outfile_name + f_extension)
-        os.remove(transparent_image_name)
     except Exception as e:
         session.rollback()
         raise e
@@ -332,22 +296,7 @@ def preview_fabric_locaiton_coverage(self, data, userid, outfile_name):
 
         rasterData = towerVal.raster_data
 
-        # Specify the path for the .png file
-        image_file_path = f"{outfile_name}.png"
-
-        # Write the binary image data to a .png file
-        with open(image_file_path, 'wb') as image_file:
-            image_file.write(rasterData.image_data)
-
-        smooth_edges(image_file_path, image_file_path, 2)
-        gdal_translate_cmd = f"gdal_translate -a_ullr {rasterData.west_bound} {rasterData.north_bound} {rasterData.east_bound} {rasterData.south_bound} -a_srs EPSG:4326 {image_file_path} {outfile_name}.tif"
-        logger.debug("Executing:", gdal_translate_cmd)
-        subprocess.run(gdal_translate_cmd, shell=True)
-
-        # Execute gdal_polygonize.py
-        gdal_polygonize_cmd = f"gdal_polygonize.py {outfile_name}.tif -f \"KML\" {outfile_name}.kml"
-        logger.debug("Executing:", gdal_polygonize_cmd)
-        subprocess.run(gdal_polygonize_cmd, shell=True)
+        wireless_coverage = vectorize_raster(rasterData.image_data, rasterData.north_bound, rasterData.south_bound, rasterData.east_bound, rasterData.west_bound, RASTER_SMOOTHING_ITERATIONS, RASTER_SMOOTHING_KERNEL_RADIUS)
 
         userVal = user_ops.get_user_with_id(userid=userid)
         folderVal = folder_ops.get_upload_folder(userVal.organization_id, session=session)
@@ -355,9 +304,7 @@ def preview_fabric_locaiton_coverage(self, data, userid, outfile_name):
              return {'error': 'Folder not found'}
 
         logger.debug("Computing covered points")
-        covered_points = kml_ops.preview_wireless_locations(folderVal.id, outfile_name + '.kml')
-        for f_extension in wireless_vector_file_format:
-            os.remove(outfile_name + f_extension)
+        covered_points = kml_ops.preview_wireless_locations(folderVal.id, wireless_coverage)
         # Convert the GeoDataFrame to a JSON-friendly format, such as GeoJSON
         covered_points_geojson = covered_points.to_json()
         geojson_filename = outfile_name + '.geojson'
@@ -384,22 +331,7 @@ def raster2vector(self, data, userid, outfile_name):
 
         rasterData = towerVal.raster_data
 
-        # Specify the path for the .png file
-        image_file_path = f"{outfile_name}.png"
-
-        # Write the binary image data to a .png file
-        with open(image_file_path, 'wb') as image_file:
-            image_file.write(rasterData.image_data)
-
-        smooth_edges(image_file_path, image_file_path, 2)
-        gdal_translate_cmd = f"gdal_translate -a_ullr {rasterData.west_bound} {rasterData.north_bound} {rasterData.east_bound} {rasterData.south_bound} -a_srs EPSG:4326 {image_file_path} {outfile_name}.tif"
-        logger.debug("Executing:", gdal_translate_cmd)
-        subprocess.run(gdal_translate_cmd, shell=True)
-
-        # Execute gdal_polygonize.py
-        gdal_polygonize_cmd = f"gdal_polygonize.py {outfile_name}.tif -f \"KML\" {outfile_name}.kml"
-        logger.debug("Executing:", gdal_polygonize_cmd)
-        subprocess.run(gdal_polygonize_cmd, shell=True)
+        wireless_coverage = vectorize_raster(rasterData.image_data, rasterData.north_bound, rasterData.south_bound, rasterData.east_bound, rasterData.west_bound, RASTER_SMOOTHING_ITERATIONS, RASTER_SMOOTHING_KERNEL_RADIUS)
 
         userVal = user_ops.get_user_with_id(userid, session=session)
         folderVal = folder_ops.get_upload_folder(userVal.organization_id, session=session)
@@ -411,32 +343,21 @@ def raster2vector(self, data, userid, outfile_name):
             session.commit()
 
         vector_file_name = outfile_name + '.kml'
-        with open(vector_file_name, 'rb') as vector_file:
-            kml_binarydata = vector_file.read()
-            fileVal = file_ops.create_file(vector_file_name, kml_binarydata, folderVal.id, 'wireless', session=session)
-            session.commit()
-            downloadSpeed = data['downloadSpeed']
-            uploadSpeed = data['uploadSpeed']
-            techType = data['techType']
-            latency = data['latency']
-            category = data['categoryCode']
-        
-            kml_ops.compute_wireless_locations(fileVal.folder_id, fileVal.id, downloadSpeed, uploadSpeed, techType, latency, category, session)
-            geojson_array = []
-            all_kmls = file_ops.get_files_with_postfix(fileVal.folder_id, '.kml', session)
-            for kml_f in all_kmls:
-                geojson_array.append(vt_ops.read_kml(kml_f.id, session))
-            all_geojsons = file_ops.get_files_with_postfix(fileVal.folder_id, '.geojson', session)
-            for geojson_f in all_geojsons:
-                geojson_array.append(vt_ops.read_geojson(geojson_f.id, session))
-            
-            logger.info("Creating Vector Tiles")
-            mbtiles_ops.delete_mbtiles(fileVal.folder_id, session)
-            session.commit()
-            vt_ops.create_tiles(geojson_array, fileVal.folder_id, session)
+        kml_binarydata = coverage_to_kml(wireless_coverage, outfile_name).encode('utf-8')
+        fileVal = file_ops.create_file(vector_file_name, kml_binarydata, folderVal.id, 'wireless', session=session)
+        session.commit()
+        downloadSpeed = data['downloadSpeed']
+        uploadSpeed = data['uploadSpeed']
+        techType = data['techType']
+        latency = data['latency']
+        category = data['categoryCode']
+    
+        kml_ops.compute_wireless_locations(fileVal.folder_id, fileVal.id, downloadSpeed, uploadSpeed, techType, latency, category, session, wireless_coverage=wireless_coverage)
+        logger.info("Creating Vector Tiles")
+        mbtiles_ops.delete_mbtiles(fileVal.folder_id, session)
+        session.commit()
+        vt_ops.create_tiles(fileVal.folder_id, session, tiling_progress(self))
 
-        for f_extension in wireless_vector_file_format:
-            os.remove(outfile_name + f_extension)
         return {'Status': "Ok"}
     except Exception as e:
         return {'error': str(e)}
@@ -447,13 +368,15 @@ def raster2vector(self, data, userid, outfile_name):
 def async_org_delete(self, orgid):
     try:
         session = Session()
-        organization = organization_ops.get_organization_with_orgid(org_id=orgid, session=session)
-        users = organization_ops.get_all_users_for_organization(org_id=orgid, session=session)
-        for user in users:
-            user.organization_id = None
-        
-        session.delete(organization)
+        user_ids = [user.id for user in organization_ops.get_all_users_for_organization(org_id=orgid, session=session)]
+        # Folders with all their data, towers and task records go with the organization through ON DELETE CASCADE,
+        # its users are detached by ON DELETE SET NULL
+        session.query(organization).filter(organization.id == orgid).delete(synchronize_session=False)
         session.commit()
+        for user_id in user_ids:
+            publish_invalidation('user_org', user_id)
+        prune_tilesets()
+        fabric_ops.prune_fabric_artifacts()
     except Exception as e:
         session.rollback()  # Rollback any changes if there's an exception
         raise e
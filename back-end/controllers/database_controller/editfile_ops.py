@@ -49,6 +49,19 @@ def get_editfile_with_id(fileid, session=None):
         if owns_session:
             session.close()
 
+def get_editfile_data(fileid, session=None):
+    # editfile.data is deferred, this reads it
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        return session.query(editfile.data).filter(editfile.id == fileid).scalar()
+    finally:
+        if owns_session:
+            session.close()
+
 def create_editfile(filename, content, folderid, session=None):
     owns_session = False
     if session is None:
@@ -98,24 +111,18 @@ def get_editfilesinfo_in_folder(folderid, session=None):
 
 
 
-def delete_editfile(editfileid, session=None):
+def delete_editfiles(editfileids, session=None):
+    # One statement; file links go with the editfiles through ON DELETE CASCADE
     owns_session = False
     if session is None:
         session = Session()
         owns_session = True
 
     try:
-        editfile_to_del = session.query(editfile).filter(editfile.id == editfileid).first()
-        if editfile_to_del:
-            # Delete all associated file links first
-            links = session.query(file_editfile_link).filter(file_editfile_link.editfile_id == editfileid).all()
-            for link in links:
-                session.delete(link)
-
-            # Proceed to delete the editfile
-            session.delete(editfile_to_del)
-            if owns_session:
-                session.commit()
+        deleted = session.query(editfile).filter(editfile.id.in_(list(editfileids))).delete(synchronize_session=False)
+        if owns_session:
+            session.commit()
+        return deleted
 
     except SQLAlchemyError as e:
         if owns_session:
@@ -126,6 +133,9 @@ def delete_editfile(editfileid, session=None):
         if owns_session:
             session.close()
 
+def delete_editfile(editfileid, session=None):
+    return delete_editfiles([editfileid], session)
+
 
 
 def editfile_belongs_to_organization(file_id, user_id, session):
@@ -1,16 +1,29 @@
-from sqlalchemy import create_engine, and_
-from utils.settings import DATABASE_URL
-from io import StringIO
-import psycopg2
+from sqlalchemy import create_engine, and_, or_, case, func, literal
+from utils.settings import DATABASE_URL, FABRIC_CACHE_MAX_ENTRIES, FABRIC_CACHE_MAX_ROWS, FABRIC_ARTIFACT_DIR, FABRIC_ARTIFACT_COMPRESSION
+from io import StringIO, BytesIO
+from collections import OrderedDict
+import os, tempfile, psycopg2, pandas, geopandas, pyarrow
+from pyarrow import feather
 from database.sessions import ScopedSession, Session
 from utils.facts import states
 from database.models import fabric_data, file
 from psycopg2.errors import UniqueViolation
 from threading import Lock
 from .file_ops import get_files_with_postfix
+from utils.logger_config import logger
 
 db_lock = Lock()
 
+# Per-process LRU of fabric GeoDataFrames, keyed by folder id and the (id, timestamp) of its fabric files
+fabric_cache = OrderedDict()
+fabric_cache_lock = Lock()
+
+# Each fabric upload is also kept as a typed Feather (Arrow IPC) file under FABRIC_ARTIFACT_DIR, named by file id,
+# so coverage computation loads columns instead of parsing the CSV blob again
+# Nullable types, so blank cells load as missing values instead of failing the whole file
+FABRIC_DTYPES = {'location_id': 'Int64', 'latitude': 'float64', 'longitude': 'float64', 'bsl_flag': 'boolean'}
+FABRIC_COVERAGE_COLUMNS = ['location_id', 'address_primary', 'latitude', 'longitude', 'bsl_flag']
+
 def check_num_records_greater_zero(folderid):
     session = Session()
 
@@ -32,7 +45,8 @@ def check_num_records_greater_zero(folderid):
 def write_to_db(fileid): 
     session = ScopedSession()
     with db_lock: 
-        file_record = session.query(file).filter(file.id == fileid).first()
+        # A plain row rather than the entity, file.data is deferred and could not be loaded once the session is closed
+        file_record = session.query(file.name, file.data).filter(file.id == fileid).first()
         session.close() 
 
     if not file_record:
@@ -40,6 +54,12 @@ def write_to_db(fileid):
 
     csv_data = file_record.data.decode()
 
+    try:
+        save_fabric_artifact(fileid, read_fabric_csv(file_record.data))
+    except Exception as e:
+        # Coverage computation rebuilds a missing artifact from the CSV
+        logger.warning(f"Could not build the columnar artifact of fabric file {fileid}: {e}")
+
     engine = create_engine(DATABASE_URL)
     connection = engine.raw_connection()
     try:
@@ -62,57 +82,155 @@ def write_to_db(fileid):
     finally:
         connection.close()
 
-def address_query(folderid, query, session):
-    all_fabric = get_files_with_postfix(folderid, '.csv', session)
-    all_kml = get_files_with_postfix(folderid, '.kml', session)
-    all_geojson = get_files_with_postfix(folderid, '.geojson', session)
-    all_files_ids = [file.id for file in all_fabric + all_kml + all_geojson]
-    
-    results = []
+def get_fabric_cache_key(folderid, session):
+    fabric_files = (session.query(file.id, file.timestamp)
+                    .filter(file.folder_id == folderid, file.name.endswith('.csv'))
+                    .order_by(file.id)
+                    .all())
+    return (folderid, tuple((fabric_file.id, fabric_file.timestamp) for fabric_file in fabric_files))
+
+def get_fabric_artifact_path(fileid):
+    return os.path.join(FABRIC_ARTIFACT_DIR, f'{fileid}.feather')
+
+def read_fabric_csv(csv_data):
+    df = pandas.read_csv(BytesIO(csv_data), dtype=FABRIC_DTYPES)
+    # bsl_flag masks the frame during coverage computation, a blank flag counts as not a BSL
+    df['bsl_flag'] = df['bsl_flag'].fillna(False).astype(bool)
+    return df
+
+def save_fabric_artifact(fileid, df):
+    os.makedirs(FABRIC_ARTIFACT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=FABRIC_ARTIFACT_DIR, suffix='.tmp')
+    os.close(fd)
+    try:
+        feather.write_feather(df, tmp_path, compression=FABRIC_ARTIFACT_COMPRESSION)
+        os.replace(tmp_path, get_fabric_artifact_path(fileid))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def load_fabric_frame(fileid, session):
+    # Memory-maps the artifact, which is zero-copy for the numeric columns when it is stored uncompressed.
+    # Uploads from before the artifacts existed, or from another host, are converted on first use
+    path = get_fabric_artifact_path(fileid)
+    if os.path.exists(path):
+        try:
+            return feather.read_table(path, columns=FABRIC_COVERAGE_COLUMNS, memory_map=True).to_pandas()
+        except (pyarrow.ArrowException, OSError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable fabric artifact {path}: {e}")
+
+    csv_data = session.query(file.data).filter(file.id == fileid).scalar()
+    if csv_data is None:
+        raise ValueError(f"No fabric file found with id {fileid}")
+    df = read_fabric_csv(csv_data)
+    try:
+        save_fabric_artifact(fileid, df)
+    except OSError as e:
+        logger.warning(f"Could not save the columnar artifact of fabric file {fileid}: {e}")
+    return df[FABRIC_COVERAGE_COLUMNS]
+
+def delete_fabric_artifacts(file_ids):
+    for fileid in file_ids:
+        try:
+            os.remove(get_fabric_artifact_path(fileid))
+        except FileNotFoundError:
+            pass
+
+def prune_fabric_artifacts():
+    # Removes artifacts of fabric files that no longer exist, e.g. after their folder was deleted
+    try:
+        artifact_ids = {int(name[:-len('.feather')]) for name in os.listdir(FABRIC_ARTIFACT_DIR)
+                        if name.endswith('.feather') and name[:-len('.feather')].isdigit()}
+    except FileNotFoundError:
+        return
+    if not artifact_ids:
+        return
+
+    session = Session()
+    try:
+        existing = {fileid for fileid, in session.query(file.id).filter(file.id.in_(artifact_ids))}
+    finally:
+        session.close()
+    delete_fabric_artifacts(artifact_ids - existing)
+
+def load_fabric_geodataframe(file_ids, session):
+    df = pandas.concat([load_fabric_frame(fileid, session) for fileid in file_ids], ignore_index=True)
+
+    fabric = geopandas.GeoDataFrame(
+        df,
+        crs="EPSG:4326",
+        geometry=geopandas.points_from_xy(df.longitude, df.latitude))
+    # Build the spatial index now so every join against the cached frame reuses it
+    fabric.sindex
+    return fabric
+
+def get_fabric_geodataframe(folderid, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        key = get_fabric_cache_key(folderid, session)
+        if not key[1]:
+            raise ValueError(f"No fabric file found")
+
+        with fabric_cache_lock:
+            fabric = fabric_cache.get(key)
+            if fabric is not None:
+                fabric_cache.move_to_end(key)
+                return fabric
+
+        fabric = load_fabric_geodataframe([fileid for fileid, _ in key[1]], session)
+
+        with fabric_cache_lock:
+            fabric_cache[key] = fabric
+            fabric_cache.move_to_end(key)
+            # Evict least recently used fabrics, but always keep the one just loaded
+            while len(fabric_cache) > 1 and (len(fabric_cache) > FABRIC_CACHE_MAX_ENTRIES or
+                                             sum(len(cached) for cached in fabric_cache.values()) > FABRIC_CACHE_MAX_ROWS):
+                evicted_key, _ = fabric_cache.popitem(last=False)
+                logger.debug(f"Evicted fabric of folder {evicted_key[0]} from cache")
+        return fabric
+    finally:
+        if owns_session:
+            session.close()
 
-    if query:
-        query_split = query.split()
+def address_query(folderid, query, session, limit=9):
+    if not query:
+        return []
 
+    query_split = query.split()
+    simple_query = fabric_data.address_primary.ilike('%' + query + '%')
+    candidates = simple_query
+    rank = literal(2)
+
+    # Multi-word queries may end in a city and/or state; rank rows that match those first
+    if len(query_split) >= 2:
         primary_address_query = fabric_data.address_primary.ilike('%' + ' '.join(query_split[:-1]) + '%')
-        city_query = fabric_data.city.ilike(query_split[-1])
-        state_query = fabric_data.state.ilike(query_split[-1])
+        if query_split[-1].upper() in states:
+            locality_query = fabric_data.state.ilike(query_split[-1])
+        else:
+            locality_query = fabric_data.city.ilike(query_split[-1])
+        whens = [(and_(primary_address_query, locality_query), 1)]
 
         if len(query_split) >= 3:
             city_state_query = and_(
                 fabric_data.city.ilike(query_split[-2]),
                 fabric_data.state.ilike(query_split[-1])
             )
-
-            results.extend(
-                session.query(fabric_data)
-                .filter(primary_address_query, city_state_query, fabric_data.file_id.in_(all_files_ids))
-                .limit(1)
-                .all()
-            )
-
-        if len(query_split) >= 2:
-            if query_split[-1].upper() in states:
-                results.extend(
-                    session.query(fabric_data)
-                    .filter(primary_address_query, state_query, fabric_data.file_id.in_(all_files_ids))
-                    .limit(3)
-                    .all()
-                )
-            else:
-                results.extend(
-                    session.query(fabric_data)
-                    .filter(primary_address_query, city_query, fabric_data.file_id.in_(all_files_ids))
-                    .limit(3)
-                    .all()
-                )
-
-        simple_query = fabric_data.address_primary.ilike('%' + query + '%')
-        results.extend(
-            session.query(fabric_data)
-            .filter(simple_query, fabric_data.file_id.in_(all_files_ids))
-            .limit(5)
-            .all()
-        )
+            whens.insert(0, (and_(primary_address_query, city_state_query), 0))
+
+        candidates = or_(simple_query, and_(primary_address_query, locality_query))
+        rank = case(*whens, else_=2)
+
+    # Both ILIKE patterns are served by the pg_trgm GIN index on address_primary
+    folder_files = session.query(file.id).filter(file.folder_id == folderid)
+    results = (session.query(fabric_data)
+               .filter(fabric_data.file_id.in_(folder_files.scalar_subquery()), candidates)
+               .order_by(rank, func.similarity(fabric_data.address_primary, query).desc())
+               .limit(limit)
+               .all())
 
     results_dict = [
         {
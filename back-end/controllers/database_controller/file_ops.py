@@ -115,6 +115,19 @@ def get_file_with_id(fileid, session=None):
         if owns_session:
             session.close()
 
+def get_file_data(fileid, session=None):
+    # file.data is deferred, so listing and lookup queries never move file contents; this reads them
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        return session.query(file.data).filter(file.id == fileid).scalar()
+    finally:
+        if owns_session:
+            session.close()
+
 def get_file_with_name(filename, folderid, session=None):
     owns_session = False
     if session is None:
@@ -208,26 +221,18 @@ def get_filesinfo_in_folder(folderid, session=None):
         if owns_session:
             session.close()
 
-def delete_file(fileid, session=None):
+def delete_files(fileids, session=None):
+    # One statement; fabric_data, kml_data and editfile links go with the files through ON DELETE CASCADE
     owns_session = False
     if session is None:
         session = Session()
         owns_session = True
 
     try:
-        file_to_del = get_file_with_id(fileid, session)
-        file_to_del = get_file_with_id(fileid, session)
-        if file_to_del:
-            # Delete all associated editfile links first
-            links = session.query(file_editfile_link).filter(file_editfile_link.file_id == fileid).all()
-            for link in links:
-                session.delete(link)
-
-            # Proceed to delete the file
-            session.delete(file_to_del)
-            if owns_session:
-                session.commit()
-
+        deleted = session.query(file).filter(file.id.in_(list(fileids))).delete(synchronize_session=False)
+        if owns_session:
+            session.commit()
+        return deleted
 
     except SQLAlchemyError as e:
         if owns_session:
@@ -238,6 +243,9 @@ def delete_file(fileid, session=None):
         if owns_session:
             session.close()
 
+def delete_file(fileid, session=None):
+    return delete_files([fileid], session)
+
 
 def file_belongs_to_organization(file_id, user_id, session):
     # Retrieve the user based on user_id
@@ -1,10 +1,20 @@
 import psycopg2
 from database.sessions import ScopedSession, Session
-from database.models import user, folder
+from database.models import user, folder, file, editfile, file_editfile_link, fabric_data, kml_data, mbtiles, vector_tiles
 from threading import Lock
+from datetime import datetime
+from sqlalchemy import select, insert, literal, values, column, Integer
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.exc import SQLAlchemyError
 from .user_ops import get_user_with_id
+from utils.local_cache import LRUCache, MISSING, register_invalidation_handler, publish_invalidation_after_commit
+from utils.settings import AUTH_CACHE_TTL
+
+# user id -> organization id and folder id -> organization id, so tile requests can be authorized without a query
+user_org_cache = LRUCache(max_entries=10000, ttl=AUTH_CACHE_TTL)
+folder_org_cache = LRUCache(max_entries=10000, ttl=AUTH_CACHE_TTL)
+register_invalidation_handler('user_org', lambda userid: user_org_cache.clear() if userid is None else user_org_cache.pop(userid))
+register_invalidation_handler('folder', lambda folderid: folder_org_cache.clear() if folderid is None else folder_org_cache.pop(folderid))
 
 def get_export_folder(orgid, folderid=None, session=None):
     owns_session = False
@@ -132,6 +142,69 @@ def get_number_of_folders_for_org(orgid, session=None):
 
 
 
+def copy_rows(model, source_filter, overrides, session, returning=False):
+    # INSERT INTO model (...) SELECT ... FROM model WHERE source_filter, with the columns in overrides replaced
+    # by SQL expressions; rows never leave the database. With returning, the new id of a single copied row
+    table = model.__table__
+    columns = [c for c in table.columns if not c.primary_key]
+    query = select(*[overrides.get(c.name, c) for c in columns]).where(source_filter)
+    statement = insert(table).from_select([c.name for c in columns], query)
+    if returning:
+        return session.execute(statement.returning(table.c.id)).scalar_one()
+    session.execute(statement)
+
+def id_mapping(name, mapping):
+    # VALUES list of (old_id, new_id) pairs to remap foreign keys inside an INSERT ... SELECT
+    return values(column('old_id', Integer), column('new_id', Integer), name=name).data(list(mapping.items()))
+
+def copy_folder(folderid, session, name=None, type=None, deadline=None, export=True):
+    # Copies a folder with its files, edits and links; exports also take the fabric and coverage rows and
+    # the tilesets. Everything is copied with INSERT ... SELECT statements in the caller's transaction
+    source = session.query(folder).filter(folder.id == folderid).one()
+    new_folder = folder(name=name if name is not None else source.name, type=type if type is not None else source.type,
+                        organization_id=source.organization_id, deadline=deadline)
+    session.add(new_folder)
+    session.flush()
+
+    now = literal(datetime.now())
+    new_folder_id = literal(new_folder.id)
+
+    file_ids = session.query(file.id).filter(file.folder_id == folderid)
+    if not export:
+        file_ids = file_ids.filter(~file.name.endswith('.csv'))
+    file_mapping = {}
+    for old_id, in file_ids.order_by(file.id).all():
+        new_id = copy_rows(file, file.id == old_id,
+                           {'folder_id': new_folder_id, 'timestamp': now, 'computed': literal(False)}, session, returning=True)
+        file_mapping[old_id] = new_id
+        if export:
+            copy_rows(fabric_data, fabric_data.file_id == old_id, {'file_id': literal(new_id)}, session)
+            copy_rows(kml_data, kml_data.file_id == old_id, {'file_id': literal(new_id)}, session)
+
+    editfile_mapping = {}
+    for old_id, in session.query(editfile.id).filter(editfile.folder_id == folderid).order_by(editfile.id).all():
+        editfile_mapping[old_id] = copy_rows(editfile, editfile.id == old_id,
+                                             {'folder_id': new_folder_id, 'timestamp': now}, session, returning=True)
+
+    if file_mapping and editfile_mapping:
+        file_map = id_mapping('file_map', file_mapping)
+        editfile_map = id_mapping('editfile_map', editfile_mapping)
+        links = (select(file_map.c.new_id, editfile_map.c.new_id)
+                 .select_from(file_editfile_link)
+                 .join(file_map, file_editfile_link.file_id == file_map.c.old_id)
+                 .join(editfile_map, file_editfile_link.editfile_id == editfile_map.c.old_id))
+        session.execute(insert(file_editfile_link.__table__).from_select(['file_id', 'editfile_id'], links))
+
+    if export:
+        tilesets = session.query(mbtiles.id, mbtiles.storage_path).filter(mbtiles.folder_id == folderid).order_by(mbtiles.id)
+        for old_id, storage_path in tilesets.all():
+            new_id = copy_rows(mbtiles, mbtiles.id == old_id, {'folder_id': new_folder_id, 'timestamp': now}, session, returning=True)
+            # File backed tilesets are content addressed, so the copy shares the same file
+            if not storage_path:
+                copy_rows(vector_tiles, vector_tiles.mbtiles_id == old_id, {'mbtiles_id': literal(new_id)}, session)
+
+    return new_folder
+
 def delete_folder(folderid, session=None):
     owns_session = False
     if session is None:
@@ -139,8 +212,10 @@ def delete_folder(folderid, session=None):
         owns_session = True
 
     try:
-        folder_to_delete = session.query(folder).filter(folder.id == folderid).one()
-        session.delete(folder_to_delete)
+        # Everything in the folder goes with it through ON DELETE CASCADE
+        if not session.query(folder).filter(folder.id == folderid).delete(synchronize_session=False):
+            return "Folder not found or unauthorized access"
+        publish_invalidation_after_commit(session, 'folder', folderid)
         if owns_session:
             session.commit()
 
@@ -174,4 +249,24 @@ def folder_belongs_to_organization(folder_id, user_id, session):
     if not folderVal:
         return False
 
-    return folderVal.organization_id == user_organization.id
\ No newline at end of file
+    return folderVal.organization_id == user_organization.id
+
+def cached_folder_belongs_to_organization(folder_id, user_id):
+    org_id = user_org_cache.get(user_id)
+    folder_org_id = folder_org_cache.get(folder_id)
+
+    if org_id is MISSING or folder_org_id is MISSING:
+        session = Session()
+        try:
+            if org_id is MISSING:
+                org_id = session.query(user.organization_id).filter(user.id == user_id).scalar()
+                user_org_cache.set(user_id, org_id)
+            if folder_org_id is MISSING:
+                folder_org_id = session.query(folder.organization_id).filter(folder.id == folder_id).scalar()
+                # Folder ids are only ever handed out once, so a missing folder is not worth remembering
+                if folder_org_id is not None:
+                    folder_org_cache.set(folder_id, folder_org_id)
+        finally:
+            session.close()
+
+    return org_id is not None and folder_org_id == org_id
@@ -1,22 +1,152 @@
 from database.models import kml_data, fabric_data, file, user, vector_tiles, mbtiles
 from sqlalchemy.exc import IntegrityError
-from utils.settings import BATCH_SIZE, DATABASE_URL
+from utils.settings import DATABASE_URL, BATCH_SIZE
 from sqlalchemy.exc import SQLAlchemyError
-from multiprocessing import Lock
+from sqlalchemy import func, or_, select, literal_column
+from sqlalchemy.dialects.postgresql import array_agg, aggregate_order_by
 from database.sessions import ScopedSession, Session
 from datetime import datetime
-import logging, uuid, psycopg2, io, pandas, geopandas, shapely
+import logging, uuid, psycopg2, io, time, pandas, geopandas, shapely, numpy
 from shapely.geometry import Point, shape
 import fiona
 from io import StringIO, BytesIO
 from .user_ops import get_user_with_id
-from .file_ops import get_files_with_postfix, get_file_with_id, get_files_with_postfix, create_file, get_files_by_type
+from .file_ops import get_files_with_postfix, get_file_with_id, get_files_with_postfix, create_file, get_files_by_type, get_file_data
+from .editfile_ops import get_editfile_data
 from .folder_ops import create_folder, get_upload_folder, get_folder_with_id
 from .file_editfile_link_ops import get_editfiles_for_file
+from .fabric_ops import get_fabric_geodataframe
 from utils.logger_config import logger
+from .staged_blob_ops import stage_bytes
 import json
 
-db_lock = Lock()
+def location_point(table):
+    # Same expression as the ix_*_location_point GiST indexes, so bounding box filters can use them
+    return func.ST_SetSRID(func.ST_MakePoint(table.longitude, table.latitude), 4326)
+
+def within_bounds(table, bounds):
+    west, south, east, north = bounds
+    return location_point(table).op('&&')(func.ST_MakeEnvelope(west, south, east, north, 4326))
+
+def served_summary_query(coverage_ids, session, bounds=None):
+    # One row per location_id merging every coverage file that serves it: the fastest network wins, every covering
+    # file is listed (latest first) and the address is taken from the latest file
+    latest = lambda column: array_agg(aggregate_order_by(column, kml_data.file_id.desc(), kml_data.id.desc()))[1]
+    query = (session.query(
+                kml_data.location_id.label('location_id'),
+                func.bool_or(kml_data.served).label('served'),
+                func.bool_or(kml_data.wireless).label('wireless'),
+                func.bool_or(kml_data.lte).label('lte'),
+                func.coalesce(func.string_agg(func.nullif(kml_data.coveredLocations, ''),
+                                              aggregate_order_by(literal_column("', '"), kml_data.file_id.desc(), kml_data.id.desc())),
+                              '').label('coveredLocations'),
+                array_agg(aggregate_order_by(kml_data.maxDownloadNetwork, kml_data.maxDownloadSpeed.desc().nullslast(),
+                                             kml_data.file_id, kml_data.id))[1].label('maxDownloadNetwork'),
+                func.max(kml_data.maxDownloadSpeed).label('maxDownloadSpeed'),
+                latest(kml_data.address_primary).label('address_primary'),
+                latest(kml_data.latitude).label('latitude'),
+                latest(kml_data.longitude).label('longitude'))
+             .filter(kml_data.file_id.in_(coverage_ids)))
+    if bounds is not None:
+        query = query.filter(within_bounds(kml_data, bounds))
+    return query.group_by(kml_data.location_id)
+
+def iter_kml_data(folderid, session, bounds=None, after=None, limit=None):
+    # Streams the merged per-location rows of a folder, ordered by location_id, from a server-side cursor
+    # so callers never hold the whole folder in memory. bounds is an optional (west, south, east, north);
+    # after and limit page through the rows by location_id
+    fabric_ids = [r.id for r in session.query(file.id).filter(file.folder_id == folderid, file.type == "fabric")]
+    coverage_ids = [r.id for r in session.query(file.id).filter(
+        file.folder_id == folderid, or_(file.name.endswith(".kml"), file.name.endswith(".geojson")))]
+
+    default_data = {
+        'served': False,
+        'wireless': False,
+        'lte': False,
+        'coveredLocations': "",
+        'maxDownloadNetwork': -1,
+        'maxDownloadSpeed': -1
+    }
+
+    if fabric_ids:
+        # A location listed by several fabric files takes its attributes from the latest one
+        locations = (session.query(
+                        fabric_data.location_id,
+                        fabric_data.latitude,
+                        fabric_data.address_primary,
+                        fabric_data.longitude,
+                        fabric_data.bsl_flag)
+                     .filter(fabric_data.file_id.in_(fabric_ids)))
+        if bounds is not None:
+            locations = locations.filter(within_bounds(fabric_data, bounds))
+        if after is not None:
+            locations = locations.filter(fabric_data.location_id > after)
+        locations = (locations.distinct(fabric_data.location_id)
+                     .order_by(fabric_data.location_id, fabric_data.file_id.desc())
+                     .limit(limit)
+                     .subquery())
+
+        summary = served_summary_query(coverage_ids, session)
+        if bounds is not None or after is not None or limit is not None:
+            summary = summary.filter(kml_data.location_id.in_(select(locations.c.location_id)))
+        summary = summary.subquery()
+        query = (session.query(
+                    locations.c.location_id,
+                    locations.c.latitude,
+                    locations.c.address_primary,
+                    locations.c.longitude,
+                    locations.c.bsl_flag,
+                    summary.c.location_id.label('covered_location_id'),
+                    summary.c.served,
+                    summary.c.wireless,
+                    summary.c.lte,
+                    summary.c.coveredLocations,
+                    summary.c.maxDownloadNetwork,
+                    summary.c.maxDownloadSpeed)
+                 .outerjoin(summary, summary.c.location_id == locations.c.location_id)
+                 .order_by(locations.c.location_id))
+
+        for r in query.yield_per(BATCH_SIZE):
+            location = {
+                'location_id': r.location_id,
+                'latitude': r.latitude,
+                'address': r.address_primary,
+                'longitude': r.longitude,
+                'bsl': r.bsl_flag
+            }
+            if r.covered_location_id is None:
+                location.update(default_data)
+            else:
+                location.update({
+                    'served': r.served,
+                    'wireless': r.wireless,
+                    'lte': r.lte,
+                    'coveredLocations': r.coveredLocations,
+                    'maxDownloadNetwork': r.maxDownloadNetwork,
+                    'maxDownloadSpeed': r.maxDownloadSpeed
+                })
+            yield location
+    else:
+        summary = served_summary_query(coverage_ids, session, bounds)
+        if after is not None:
+            summary = summary.filter(kml_data.location_id > after)
+        summary = summary.order_by(kml_data.location_id).limit(limit).subquery()
+        query = session.query(summary).order_by(summary.c.location_id)
+
+        for r in query.yield_per(BATCH_SIZE):
+            yield {
+                'location_id': r.location_id,
+                'served': r.served,
+                'wireless': r.wireless,
+                'lte': r.lte,
+                'coveredLocations': r.coveredLocations,
+                'maxDownloadNetwork': r.maxDownloadNetwork,
+                'maxDownloadSpeed': r.maxDownloadSpeed,
+                'address': r.address_primary,
+                'latitude': r.latitude,
+                'longitude': r.longitude,
+                'bsl': 'False'
+            }
 
 def get_kml_data(folderid, session=None): 
     owns_session = False
@@ -24,116 +154,9 @@ def get_kml_data(folderid, session=None):
         session = Session()
         owns_session = True
 
+    data = None
     try:
-        # Query the File records related to the folder_id
-        fabric_files = get_files_by_type(folderid, "fabric", session)
-        kml_files = get_files_with_postfix(folderid, ".kml", session)
-        geojson_files = get_files_with_postfix(folderid, ".geojson", session)
-        coverage_files = kml_files + geojson_files
-
-        # Query all locations in fabric_data
-        all_data = {}
-        if len(fabric_files) > 0:
-            for fabric_file in fabric_files:
-                all_locations = session.query(
-                    fabric_data.location_id,
-                    fabric_data.latitude, 
-                    fabric_data.address_primary,
-                    fabric_data.longitude,
-                    fabric_data.bsl_flag
-                ).filter(fabric_data.file_id == fabric_file.id).all()  # Change to fabric_file.id
-
-                # Initialize a dictionary to hold location_id as key and its data as value, including location_id itself
-                all_data.update({r[0]: {'location_id': r[0], 'latitude': r[1], 'address': r[2], 'longitude': r[3], 'bsl': r[4]} for r in all_locations})
-
-            default_data = {
-                'served': False,
-                'wireless': False,
-                'lte': False,
-                'coveredLocations': "",
-                'maxDownloadNetwork': -1,
-                'maxDownloadSpeed': -1
-            }
-
-            for kml_file in coverage_files:
-                # Query all locations that are served
-                resultsServed = session.query(
-                    kml_data.location_id, 
-                    kml_data.served, 
-                    kml_data.wireless,
-                    kml_data.lte,
-                    kml_data.coveredLocations,
-                    kml_data.maxDownloadNetwork,
-                    kml_data.maxDownloadSpeed
-                ).filter(
-                    kml_data.file_id == kml_file.id  # Change to kml_file.id
-                ).all()
-
-                # Add served data to the respective location in all_data, merge two file that served the same point,
-                # record the maxdownloadnetwork and maxuploadspeed
-                for r in resultsServed:
-                    if r[0] in all_data:
-                        existing_data = all_data[r[0]]
-                        new_data = {
-                            'served': r[1],
-                            'wireless': r[2] or existing_data.get('wireless', False),
-                            'lte': r[3] or existing_data.get('lte', False),
-                            'coveredLocations': ', '.join(filter(None, [r[4], existing_data.get('coveredLocations', '')])),
-                            'maxDownloadNetwork': r[5] if r[6] > existing_data.get('maxDownloadSpeed', -1) else existing_data.get('maxDownloadNetwork', ''),
-                            'maxDownloadSpeed': max(r[6], existing_data.get('maxDownloadSpeed', -1))
-                        }
-                        # Merge the existing and new data
-                        all_data[r[0]].update(new_data)
-                    else:
-                        # The location was not in the fabric file, but it is in one of the KML files
-                        # You need to decide how to handle this situation.
-                        pass
-
-                # For all other locations, fill with default values
-            for loc in all_data.values():
-                for key, value in default_data.items():
-                    loc.setdefault(key, value)
-        else:
-            for kml_file in coverage_files:
-                print(kml_file.name)
-                # Query all locations that are served
-                resultsServed = session.query(
-                    kml_data.location_id, 
-                    kml_data.served, 
-                    kml_data.wireless,
-                    kml_data.lte,
-                    kml_data.coveredLocations,
-                    kml_data.maxDownloadNetwork,
-                    kml_data.maxDownloadSpeed,
-                    kml_data.address_primary,
-                    kml_data.latitude,
-                    kml_data.longitude
-                ).filter(
-                    kml_data.file_id == kml_file.id  # Change to kml_file.id
-                ).all()
-
-                # Add served data to the respective location in all_data, merge two file that served the same point,
-                # record the maxdownloadnetwork and maxuploadspeed
-                for r in resultsServed:
-                    existing_data = all_data.get(r[0], {})
-                    new_data = {
-                        'location_id': r[0],
-                        'served': r[1],
-                        'wireless': r[2] or existing_data.get('wireless', False),
-                        'lte': r[3] or existing_data.get('lte', False),
-                        'coveredLocations': ', '.join(filter(None, [r[4], existing_data.get('coveredLocations', '')])),
-                        'maxDownloadNetwork': r[5] if r[6] > existing_data.get('maxDownloadSpeed', -1) else existing_data.get('maxDownloadNetwork', ''),
-                        'maxDownloadSpeed': max(r[6], existing_data.get('maxDownloadSpeed', -1)),
-                        'address': r[7],
-                        'latitude': r[8],
-                        'longitude': r[9],
-                        'bsl': 'False',
-                    }
-                    # Merge the existing and new data
-                    all_data[r[0]] = new_data
-
-        # Convert dictionary values to a list
-        data = list(all_data.values())
+        data = list(iter_kml_data(folderid, session))
     except SQLAlchemyError as e:
         print('Error when querying the database')
         return None
@@ -156,60 +179,62 @@ def get_kml_data_by_file(fileid, session=None):
         if owns_session:
             session.close()
 
-def add_to_db(pandaDF, kmlid, download, upload, tech, wireless, latency, category, session):
-    batch = [] 
-
-    fileVal = get_file_with_id(kmlid)
+KML_DATA_COPY_COLUMNS = ['location_id', 'served', 'wireless', 'lte', 'coveredLocations', 'maxDownloadNetwork', 'maxDownloadSpeed',
+                         'maxUploadSpeed', 'techType', 'file_id', 'address_primary', 'longitude', 'latitude', 'latency', 'category']
 
-    for _, row in pandaDF.iterrows():
-        try:
-            if row.location_id == '': 
-                continue
-            
-            if download == "": 
-                download = 0
-                
-            newData = kml_data(
-                location_id = int(row.location_id),
-                served = True,
-                wireless = wireless,
-                lte = False,
-                coveredLocations = fileVal.name,
-                maxDownloadNetwork = fileVal.name,
-                maxDownloadSpeed = int(download), 
-                maxUploadSpeed = int(upload), 
-                techType = tech,
-                file_id = fileVal.id,
-                address_primary = row.address_primary,
-                longitude = row.longitude,
-                latitude = row.latitude,
-                latency = latency, 
-                category = category
-            )
-            batch.append(newData)
-
-            if len(batch) >= BATCH_SIZE:
-                with db_lock:
-                    try:
-                        session.bulk_save_objects(batch)
-                        session.commit()
-                    except IntegrityError:
-                        session.rollback()
-                
-                batch = []
-        except Exception as e:
-            logging.error(f"Error occurred while inserting data: {e}")
-            return False 
-
-    if batch:
-        with db_lock:
-            try:
-                session.bulk_save_objects(batch)
-                session.commit()
-            except IntegrityError:
-                session.rollback() 
-    session.commit()
+def add_to_db(pandaDF, kmlid, download, upload, tech, wireless, latency, category, session):
+    # Streams the covered points into kml_data with COPY on the session's own connection,
+    # so the rows land in the caller's transaction and are committed once
+    filename = session.query(file.name).filter(file.id == kmlid).scalar()
 
+    if download == "":
+        download = 0
+    try:
+        download = int(download)
+        upload = int(upload)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error occurred while inserting data: {e}")
+        return False
+
+    start_time = time.perf_counter()
+    rows = pandas.DataFrame({
+        'location_id': pandas.to_numeric(pandaDF['location_id'], errors='coerce').astype('Int64'),
+        'served': True,
+        'wireless': bool(wireless),
+        'lte': False,
+        'coveredLocations': filename,
+        'maxDownloadNetwork': filename,
+        'maxDownloadSpeed': download,
+        'maxUploadSpeed': upload,
+        'techType': tech,
+        'file_id': kmlid,
+        'address_primary': pandaDF['address_primary'],
+        'longitude': pandaDF['longitude'],
+        'latitude': pandaDF['latitude'],
+        'latency': latency,
+        'category': category
+    }, columns=KML_DATA_COPY_COLUMNS)
+    rows = rows[rows['location_id'].notna()]
+
+    if rows.empty:
+        return True
+
+    buffer = StringIO()
+    rows.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{column}"' for column in KML_DATA_COPY_COLUMNS)
+    try:
+        dbapi_connection = session.connection().connection
+        with dbapi_connection.cursor() as cur:
+            cur.copy_expert(f"COPY kml_data ({columns}) FROM STDIN WITH (FORMAT CSV)", buffer)
+    except (SQLAlchemyError, psycopg2.Error) as e:
+        session.rollback()
+        logger.error(f"Error occurred while inserting data: {e}")
+        return False
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Wrote {len(rows)} kml_data rows for file {kmlid} in {elapsed:.2f}s ({len(rows) / max(elapsed, 1e-6):.0f} rows/s)")
     return True
 
 def generate_csv_data(results, provider_id, brand_name):
@@ -241,9 +266,8 @@ def export(folderid, providerid, brandname, deadline, session):
 
     output = io.BytesIO()
     availability_csv.to_csv(output, index=False, encoding='utf-8')
-    csv_data_str = availability_csv.to_csv(index=False, encoding='utf-8')
 
-    async_folder_copy_for_export.apply_async(args=[folderid, csv_data_str, brandname, deadline])
+    async_folder_copy_for_export.apply_async(args=[folderid, stage_bytes(output.getvalue()), brandname, deadline])
 
     return output
 
@@ -257,13 +281,18 @@ def rename_conflicting_columns(gdf):
         rename_dict['index_right'] = 'index_right_original'
     return gdf.rename(columns=rename_dict)
 
+def fabric_points_in_coverage(fabric, coverage):
+    """Return the fabric points that intersect any coverage geometry, using the fabric's cached spatial index."""
+    _, fabric_idx = fabric.sindex.query_bulk(coverage.geometry, predicate="intersects")
+    return fabric.iloc[numpy.unique(fabric_idx)]
+
 def filter_points_within_editfile_polygons(points_gdf, coverage_file, session):
     all_polygons = []
 
     editfiles = get_editfiles_for_file(coverage_file.id, session)
     for editfile in editfiles:
         try:
-            geojson_feature = json.loads(editfile.data.decode('utf-8'))
+            geojson_feature = json.loads(get_editfile_data(editfile.id, session).decode('utf-8'))
             if geojson_feature['geometry']['type'] == 'Polygon':
                 polygon = shape(geojson_feature['geometry'])
                 all_polygons.append(polygon)
@@ -284,27 +313,8 @@ def filter_points_within_editfile_polygons(points_gdf, coverage_file, session):
 
     return points_gdf
 
-def compute_wireless_locations(folderid, kmlid, download, upload, tech, latency, category, session):
-    
-    fabric_files = get_files_with_postfix(folderid, '.csv')
-    coverage_file = get_file_with_id(kmlid)
-
-    
-    if fabric_files is None or coverage_file is None:
-        raise FileNotFoundError("Fabric or coverage file not found in the database")
-    
-    fabric_arr = []
-    for fabric_file in fabric_files:
-        tempdf = pandas.read_csv(StringIO(fabric_file.data.decode()))
-        fabric_arr.append(tempdf)
-    df = pandas.concat(fabric_arr)
-
-    fabric = geopandas.GeoDataFrame(
-        df,
-        crs="EPSG:4326",
-        geometry=[shapely.geometry.Point(xy) for xy in zip(df.longitude, df.latitude)])
-    
-    coverage_data = BytesIO(coverage_file.data)
+def read_wireless_coverage(coverage_file, session):
+    coverage_data = BytesIO(get_file_data(coverage_file.id, session))
     if (coverage_file.name.endswith('.kml')):
         fiona.drvsupport.supported_drivers['kml'] = 'rw'
         fiona.drvsupport.supported_drivers['KML'] = 'rw'
@@ -312,87 +322,12 @@ def compute_wireless_locations(folderid, kmlid, download, upload, tech, latency,
     else:
         wireless_coverage = geopandas.read_file(coverage_data)
 
-    wireless_coverage = wireless_coverage.to_crs("EPSG:4326")
-    fabric = rename_conflicting_columns(fabric)
-    wireless_coverage = rename_conflicting_columns(wireless_coverage)
-    fabric_in_wireless = geopandas.sjoin(fabric,wireless_coverage,how="inner")
-    bsl_fabric_in_wireless = fabric_in_wireless[fabric_in_wireless['bsl_flag']]
-    bsl_fabric_in_wireless = bsl_fabric_in_wireless.drop_duplicates(subset='location_id', keep='first')
-
-    bsl_fabric_in_wireless = filter_points_within_editfile_polygons(bsl_fabric_in_wireless, coverage_file, session)
-    bsl_fabric_in_wireless = bsl_fabric_in_wireless.drop_duplicates(subset='location_id', keep='first')
-
-    logger.debug(f'number of points computed: {len(bsl_fabric_in_wireless)}')
-    res = add_to_db(bsl_fabric_in_wireless, kmlid, download, upload, tech, True, latency, category, session)
-    return res
-
-def preview_wireless_locations(folderid, kml_filename):
-    
-    fabric_files = get_files_with_postfix(folderid, '.csv')
-    with open(kml_filename, 'rb') as file:  # Open the file in binary mode
-        coverage_data = file.read()  # Read the entire content of the file into memory
-
-    
-    if fabric_files is None:
-        raise FileNotFoundError("Fabric or coverage file not found in the database")
-    
-    fabric_arr = []
-    for fabric_file in fabric_files:
-        tempdf = pandas.read_csv(StringIO(fabric_file.data.decode()))
-        fabric_arr.append(tempdf)
-    df = pandas.concat(fabric_arr)
-
-    fabric = geopandas.GeoDataFrame(
-        df,
-        crs="EPSG:4326",
-        geometry=[shapely.geometry.Point(xy) for xy in zip(df.longitude, df.latitude)])
-    
-    coverage_data_io = BytesIO(coverage_data)
-    
-    fiona.drvsupport.supported_drivers['kml'] = 'rw'
-    fiona.drvsupport.supported_drivers['KML'] = 'rw'
-    wireless_coverage = geopandas.read_file(coverage_data_io, driver='KML')
-
-
-    wireless_coverage = wireless_coverage.to_crs("EPSG:4326")
-    fabric = rename_conflicting_columns(fabric)
-    wireless_coverage = rename_conflicting_columns(wireless_coverage)
-    fabric_in_wireless = geopandas.sjoin(fabric,wireless_coverage,how="inner")
-    bsl_fabric_in_wireless = fabric_in_wireless[fabric_in_wireless['bsl_flag']]
-    bsl_fabric_in_wireless = bsl_fabric_in_wireless.drop_duplicates(subset='location_id', keep='first')
-
-    logger.debug(f'number of points computed: {len(bsl_fabric_in_wireless)}')
-    return bsl_fabric_in_wireless
-
-def compute_wired_locations(folderid, kmlid, download, upload, tech, latency, category, session):
-    
-
-    # Fetch Fabric file from database
-    fabric_files = get_files_with_postfix(folderid, '.csv')
-    if not fabric_files:
-        raise ValueError(f"No fabric file found")
-    
-    fabric_arr = []
-    for fabric_file in fabric_files:
-        tempdf = pandas.read_csv(StringIO(fabric_file.data.decode()))
-        fabric_arr.append(tempdf)
-    df = pandas.concat(fabric_arr)
-
-    # Fetch Fiber file from database
-    fiber_file_record = get_file_with_id(kmlid)
-    if not fiber_file_record:
-        raise ValueError(f"No file found with name {fiber_file_record.name} and id {fiber_file_record.id}")
-    fiber_kml_data = fiber_file_record.data
+    return wireless_coverage.to_crs("EPSG:4326")
 
+def read_wired_coverage(fiber_file_record, session, buffer_meters=100):
     # Convert the KML data bytes to a file-like object
-    fiber_data = BytesIO(fiber_kml_data)
-
-    fabric = geopandas.GeoDataFrame(
-        df,
-        crs="EPSG:4326",
-        geometry=[shapely.geometry.Point(xy) for xy in zip(df.longitude, df.latitude)])
+    fiber_data = BytesIO(get_file_data(fiber_file_record.id, session))
 
-    buffer_meters = 100 
     if fiber_file_record.name.endswith('kml'):
         fiona.drvsupport.supported_drivers['kml'] = 'rw'
         fiona.drvsupport.supported_drivers['KML'] = 'rw'
@@ -406,15 +341,59 @@ def compute_wired_locations(folderid, kmlid, download, upload, tech, latency, ca
 
     fiber_paths_buffer = fiber_paths.to_crs("EPSG:5070")
     fiber_paths_buffer['geometry'] = fiber_paths_buffer.buffer(buffer_meters)
-    fiber_paths_buffer = fiber_paths_buffer.to_crs("EPSG:4326")
+    return fiber_paths_buffer.to_crs("EPSG:4326")
+
+def select_served_bsls(fabric_in_coverage, coverage_file, session):
+    bsl_fabric_in_coverage = fabric_in_coverage[fabric_in_coverage['bsl_flag']]
+    bsl_fabric_in_coverage = bsl_fabric_in_coverage.drop_duplicates(subset='location_id', keep='first')
+
+    bsl_fabric_in_coverage = filter_points_within_editfile_polygons(bsl_fabric_in_coverage, coverage_file, session)
+    return bsl_fabric_in_coverage.drop_duplicates(subset='location_id', keep='first')
+
+def compute_wireless_locations(folderid, kmlid, download, upload, tech, latency, category, session, wireless_coverage=None):
+    # wireless_coverage can be passed in when the caller already has the coverage polygons,
+    # in which case the stored coverage file is not parsed again
+    coverage_file = get_file_with_id(kmlid, session)
+    if coverage_file is None:
+        raise FileNotFoundError("Fabric or coverage file not found in the database")
+
+    fabric = get_fabric_geodataframe(folderid, session)
+
+    if wireless_coverage is None:
+        wireless_coverage = read_wireless_coverage(coverage_file, session)
+    else:
+        wireless_coverage = wireless_coverage.to_crs("EPSG:4326")
+
+    fabric_in_wireless = fabric_points_in_coverage(fabric, wireless_coverage)
+    bsl_fabric_in_wireless = select_served_bsls(fabric_in_wireless, coverage_file, session)
+
+    logger.debug(f'number of points computed: {len(bsl_fabric_in_wireless)}')
+    res = add_to_db(bsl_fabric_in_wireless, kmlid, download, upload, tech, True, latency, category, session)
+    return res
 
-    fabric_near_fiber = geopandas.sjoin(fabric, fiber_paths_buffer, how="inner")
+def preview_wireless_locations(folderid, wireless_coverage):
+    fabric = get_fabric_geodataframe(folderid)
 
-    bsl_fabric_near_fiber = fabric_near_fiber[fabric_near_fiber['bsl_flag']] 
+    wireless_coverage = wireless_coverage.to_crs("EPSG:4326")
+    fabric_in_wireless = fabric_points_in_coverage(fabric, wireless_coverage)
+    bsl_fabric_in_wireless = fabric_in_wireless[fabric_in_wireless['bsl_flag']]
+    bsl_fabric_in_wireless = bsl_fabric_in_wireless.drop_duplicates(subset='location_id', keep='first')
 
-    bsl_fabric_near_fiber = bsl_fabric_near_fiber.drop_duplicates(subset='location_id', keep='first')
-    bsl_fabric_near_fiber = filter_points_within_editfile_polygons(bsl_fabric_near_fiber, fiber_file_record, session)
-    bsl_fabric_near_fiber = bsl_fabric_near_fiber.drop_duplicates(subset='location_id', keep='first')
+    logger.debug(f'number of points computed: {len(bsl_fabric_in_wireless)}')
+    return bsl_fabric_in_wireless
+
+def compute_wired_locations(folderid, kmlid, download, upload, tech, latency, category, session):
+    # Fetch Fabric points from the per-worker cache
+    fabric = get_fabric_geodataframe(folderid, session)
+
+    # Fetch Fiber file from database
+    fiber_file_record = get_file_with_id(kmlid, session)
+    if not fiber_file_record:
+        raise ValueError(f"No file found with id {kmlid}")
+
+    fiber_paths_buffer = read_wired_coverage(fiber_file_record, session)
+    fabric_near_fiber = fabric_points_in_coverage(fabric, fiber_paths_buffer)
+    bsl_fabric_near_fiber = select_served_bsls(fabric_near_fiber, fiber_file_record, session)
 
     res = add_to_db(bsl_fabric_near_fiber, kmlid, download, upload, tech, False, latency, category, session)
     return res 
@@ -427,4 +406,40 @@ def add_network_data(folderid, kmlid ,download, upload, tech, type, latency, cat
         res = compute_wireless_locations(folderid, kmlid, download, upload, tech, latency, category, session)
     return res 
 
+def is_wired(coverage_file):
+    return coverage_file.type.strip().lower() == "wired"
 
+def add_network_data_batch(folderid, coverage_files, session):
+    """Compute coverage for several files of a folder with a single spatial index query against the fabric."""
+    if not coverage_files:
+        return True
+
+    fabric = get_fabric_geodataframe(folderid, session)
+
+    tagged_coverages = []
+    for coverage_file in coverage_files:
+        if is_wired(coverage_file):
+            coverage = read_wired_coverage(coverage_file, session)
+        else:
+            coverage = read_wireless_coverage(coverage_file, session)
+        coverage = coverage[['geometry']].copy()
+        coverage['file_id'] = coverage_file.id
+        tagged_coverages.append(coverage)
+    all_coverage = pandas.concat(tagged_coverages, ignore_index=True)
+
+    coverage_idx, fabric_idx = fabric.sindex.query_bulk(all_coverage.geometry, predicate="intersects")
+    matches = pandas.DataFrame({
+        'file_id': all_coverage['file_id'].values[coverage_idx],
+        'fabric_idx': fabric_idx
+    }).drop_duplicates()
+    matches_by_file = {file_id: group['fabric_idx'].values for file_id, group in matches.groupby('file_id')}
+
+    # All files are copied in the caller's transaction; a failed copy has rolled it back, so the rest are skipped
+    for coverage_file in coverage_files:
+        fabric_in_coverage = fabric.iloc[numpy.sort(matches_by_file.get(coverage_file.id, numpy.empty(0, dtype=numpy.int64)))]
+        bsl_fabric_in_coverage = select_served_bsls(fabric_in_coverage, coverage_file, session)
+        logger.debug(f'number of points computed for {coverage_file.name}: {len(bsl_fabric_in_coverage)}')
+        if not add_to_db(bsl_fabric_in_coverage, coverage_file.id, coverage_file.maxDownloadSpeed, coverage_file.maxUploadSpeed,
+                         coverage_file.techType, not is_wired(coverage_file), coverage_file.latency, coverage_file.category, session):
+            return False
+    return True
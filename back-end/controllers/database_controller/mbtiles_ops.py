@@ -5,6 +5,7 @@ from datetime import datetime
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
+from utils.local_cache import publish_invalidation_after_commit
 
 def get_mbtiles_with_id(mbtid, session=None):
     owns_session = False
@@ -45,15 +46,18 @@ def get_latest_mbtiles(folderid, session=None):
         if owns_session:
             session.close()
 
-def delete_mbtiles(folderid, session=None):
+def delete_mbtiles(folderid, session=None, keep_id=None):
     owns_session = False
     if session is None:
         session = Session()
         owns_session = True
     try:
-        mbtiles_files = (session.query(mbtiles).filter(mbtiles.folder_id == folderid).all())
-        for mbtiles_f in mbtiles_files:
-            session.delete(mbtiles_f)
+        query = session.query(mbtiles).filter(mbtiles.folder_id == folderid)
+        if keep_id is not None:
+            query = query.filter(mbtiles.id != keep_id)
+        # vector_tiles rows go with their tileset through ON DELETE CASCADE
+        query.delete(synchronize_session=False)
+        publish_invalidation_after_commit(session, 'tileset', folderid)
         if owns_session:
             session.commit()
 
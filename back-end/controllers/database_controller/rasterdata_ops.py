@@ -23,4 +23,27 @@ def create_rasterdata(tower_id, image_data, transparent_image_data, loss_color_m
         return f"An error occurred while adding raster data to the tower: {e}"
     finally:
         if owns_session:
-            session.close()
\ No newline at end of file
+            session.close()
+
+def get_rasterdata_id_for_tower(tower_id, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+    try:
+        return session.query(rasterdata.id).filter(rasterdata.tower_id == tower_id).limit(1).scalar()
+    finally:
+        if owns_session:
+            session.close()
+
+def get_rasterdata_image(raster_id, transparent=False, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+    try:
+        column = rasterdata.transparent_image_data if transparent else rasterdata.image_data
+        return session.query(column).filter(rasterdata.id == raster_id).scalar()
+    finally:
+        if owns_session:
+            session.close()
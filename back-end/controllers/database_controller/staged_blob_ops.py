@@ -0,0 +1,231 @@
+import io, uuid, hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+from database.sessions import Session
+from database.models import staged_blob, staged_blob_chunk, user
+from utils.settings import STAGED_BLOB_TTL, UPLOAD_USER_QUOTA
+from utils.logger_config import logger
+
+# Large payloads (uploaded files, generated CSVs) are staged in the database by the web app and handed to Celery
+# tasks as small references {'id', 'sha256', 'size'}, so broker messages stay tiny whatever the file size and the
+# workers can read them from any host
+
+CHUNK_SIZE = 1024 * 1024
+
+def new_blob(owner_id, name, size, session):
+    blob = staged_blob(id=uuid.uuid4().hex, owner_id=owner_id, name=name, size=size, updated_at=datetime.now())
+    session.add(blob)
+    session.flush()
+    return blob
+
+def add_chunk(blob_id, offset, data, session):
+    # Inserted without an ORM object so large files are not kept in the session's identity map
+    session.execute(insert(staged_blob_chunk).values(blob_id=blob_id, byte_offset=offset, data=data))
+
+def iter_chunks(blob_id, session):
+    query = (session.query(staged_blob_chunk.data)
+             .filter(staged_blob_chunk.blob_id == blob_id)
+             .order_by(staged_blob_chunk.byte_offset))
+    for data, in query.yield_per(16):
+        yield bytes(data)
+
+def staged_size(blob_id, session):
+    return session.query(func.coalesce(func.sum(func.octet_length(staged_blob_chunk.data)), 0)).filter(
+        staged_blob_chunk.blob_id == blob_id).scalar()
+
+def stage_stream(stream, owner_id=None, name=None, session=None):
+    # Copies a file-like object to the staging tables chunk by chunk and returns its reference
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        blob = new_blob(owner_id, name, 0, session)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            add_chunk(blob.id, size, chunk, session)
+            digest.update(chunk)
+            size += len(chunk)
+        blob.size = size
+        blob.sha256 = digest.hexdigest()
+        ref = {'id': blob.id, 'sha256': blob.sha256, 'size': size}
+        if owns_session:
+            session.commit()
+        return ref
+    finally:
+        if owns_session:
+            session.close()
+
+def stage_bytes(data, session=None):
+    return stage_stream(io.BytesIO(data), session=session)
+
+def read_staged_blob(ref, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        data = b''.join(iter_chunks(ref['id'], session))
+        if len(data) != ref['size'] or hashlib.sha256(data).hexdigest() != ref['sha256']:
+            raise ValueError(f"Staged blob {ref['id']} is missing or does not match its checksum")
+        return data
+    finally:
+        if owns_session:
+            session.close()
+
+def discard_staged_blobs(refs, session=None):
+    # Chunks go with their blob through ON DELETE CASCADE
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        blob_ids = [ref['id'] for ref in refs]
+        if blob_ids:
+            session.query(staged_blob).filter(staged_blob.id.in_(blob_ids)).delete(synchronize_session=False)
+        if owns_session:
+            session.commit()
+    finally:
+        if owns_session:
+            session.close()
+
+def prune_staged_blobs(session=None):
+    # Removes blobs of tasks that never consumed them, e.g. after they failed for good, and abandoned uploads
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        cutoff = datetime.now() - timedelta(seconds=STAGED_BLOB_TTL)
+        removed = session.query(staged_blob).filter(staged_blob.updated_at < cutoff).delete(synchronize_session=False)
+        if owns_session:
+            session.commit()
+        if removed:
+            logger.debug(f"Removed {removed} abandoned staged blobs")
+    finally:
+        if owns_session:
+            session.close()
+
+
+# Chunked uploads: a client creates an upload, appends chunks at the offset the server reports, and completes it.
+# The upload is a staged blob with its declared size whose chunks accumulate as they arrive; completing it records
+# the checksum, which turns it into a regular staged blob, so an interrupted upload resumes from the stored bytes
+
+class UploadOffsetMismatch(Exception):
+    def __init__(self, offset):
+        super().__init__(f"Upload continues at offset {offset}")
+        self.offset = offset
+
+class UploadConflict(Exception):
+    # The upload was completed or removed while the request was in flight
+    pass
+
+class UploadQuotaExceeded(Exception):
+    pass
+
+def upload_ref(blob):
+    return {'id': blob.id, 'sha256': blob.sha256, 'size': blob.size} if blob.sha256 is not None else None
+
+def lock_upload(upload_id, session):
+    blob = session.query(staged_blob).filter(staged_blob.id == upload_id).with_for_update().first()
+    if blob is None:
+        raise UploadConflict("Upload no longer exists, please upload the file again")
+    return blob
+
+def create_upload(owner_id, name, size, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        # Uploads of the same user are created one at a time so concurrent ones cannot overrun the quota together
+        session.query(user.id).filter(user.id == owner_id).with_for_update().one()
+        staged = session.query(func.coalesce(func.sum(staged_blob.size), 0)).filter(staged_blob.owner_id == owner_id).scalar()
+        if staged + size > UPLOAD_USER_QUOTA:
+            raise UploadQuotaExceeded(f"Uploads in progress exceed the {UPLOAD_USER_QUOTA} byte limit, complete or wait for them first")
+
+        upload_id = new_blob(owner_id, name, size, session).id
+        if owns_session:
+            session.commit()
+        return upload_id
+    finally:
+        if owns_session:
+            session.close()
+
+def get_upload(upload_id, owner_id, session=None):
+    # Returns the upload with its current offset, or None for unknown uploads and uploads of other users
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        blob = session.query(staged_blob).filter(staged_blob.id == upload_id, staged_blob.owner_id == owner_id).first()
+        if blob is None:
+            return None
+        ref = upload_ref(blob)
+        offset = blob.size if ref is not None else staged_size(upload_id, session)
+        return {'owner_id': blob.owner_id, 'name': blob.name, 'size': blob.size, 'offset': offset, 'ref': ref}
+    finally:
+        if owns_session:
+            session.close()
+
+def append_upload_chunk(upload_id, offset, chunk, sha256, session=None):
+    if hashlib.sha256(chunk).hexdigest() != sha256:
+        raise ValueError("Chunk does not match its checksum")
+
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        # Appends and completion of the same upload are serialized on its row, a retried or duplicate chunk finds the
+        # offset moved on and a chunk arriving after completion finds the upload completed
+        blob = lock_upload(upload_id, session)
+        if blob.sha256 is not None:
+            raise UploadConflict("Upload is already completed")
+        current = staged_size(upload_id, session)
+        if current != offset:
+            raise UploadOffsetMismatch(current)
+        add_chunk(upload_id, offset, chunk, session)
+        blob.updated_at = datetime.now()
+        if owns_session:
+            session.commit()
+        return current + len(chunk)
+    finally:
+        if owns_session:
+            session.close()
+
+def complete_upload(upload_id, session=None):
+    owns_session = False
+    if session is None:
+        session = Session()
+        owns_session = True
+
+    try:
+        blob = lock_upload(upload_id, session)
+        if blob.sha256 is not None:
+            return upload_ref(blob)
+        current = staged_size(upload_id, session)
+        if current != blob.size:
+            raise UploadOffsetMismatch(current)
+
+        digest = hashlib.sha256()
+        for chunk in iter_chunks(upload_id, session):
+            digest.update(chunk)
+        blob.sha256 = digest.hexdigest()
+        blob.updated_at = datetime.now()
+        ref = upload_ref(blob)
+        if owns_session:
+            session.commit()
+        return ref
+    finally:
+        if owns_session:
+            session.close()
@@ -0,0 +1,225 @@
+import os, sqlite3, hashlib, shutil, time, tempfile, uuid
+from collections import OrderedDict
+from threading import Lock
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+from database.sessions import Session
+from database.models import vector_tiles, mbtiles
+from utils.settings import TILE_STORE_BACKEND, TILESET_DIR, TILESET_CONNECTION_POOL_SIZE, TILESET_MMAP_SIZE, TILESET_PRUNE_GRACE
+from utils.logger_config import logger
+
+# A tileset is stored by exactly one backend: mbtiles rows with a storage_path live in an MBTiles file
+# under TILESET_DIR, rows without one have their tiles in vector_tiles
+
+def read_tiles(mbtiles_file_path):
+    with sqlite3.connect(mbtiles_file_path) as mb_conn:
+        return mb_conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles").fetchall()
+
+class PostgresTileStore:
+    name = 'postgres'
+
+    def save(self, mbtiles_file_path, mbtiles_id, cur):
+        data = [(zoom, column, row, Binary(tile), mbtiles_id) for zoom, column, row, tile in read_tiles(mbtiles_file_path)]
+        execute_values(cur, """
+            INSERT INTO vector_tiles (zoom_level, tile_column, tile_row, tile_data, mbtiles_id)
+            VALUES %s
+            """, data)
+        return None
+
+    def update_tiles(self, mbtiles_id, storage_path, tiles, mbtiles_file_path, cur):
+        # Replaces the given (zoom, column, TMS row) tiles with those of the MBTiles file, if any, touching no other rows
+        cur.execute("CREATE TEMP TABLE dirty_tiles (zoom_level integer, tile_column integer, tile_row integer) ON COMMIT DROP")
+        execute_values(cur, "INSERT INTO dirty_tiles VALUES %s", tiles)
+        cur.execute("""
+            DELETE FROM vector_tiles v USING dirty_tiles d
+            WHERE v.mbtiles_id = %s AND v.zoom_level = d.zoom_level AND v.tile_column = d.tile_column AND v.tile_row = d.tile_row
+            """, (mbtiles_id,))
+        if mbtiles_file_path is not None:
+            wanted = set(tiles)
+            data = [(zoom, column, row, Binary(tile), mbtiles_id) for zoom, column, row, tile in read_tiles(mbtiles_file_path)
+                    if (zoom, column, row) in wanted]
+            if data:
+                execute_values(cur, """
+                    INSERT INTO vector_tiles (zoom_level, tile_column, tile_row, tile_data, mbtiles_id)
+                    VALUES %s
+                    """, data)
+        # The whole-file blob no longer matches the tiles
+        cur.execute("UPDATE mbtiles SET tile_data = NULL WHERE id = %s", (mbtiles_id,))
+        return None
+
+    def get_tile(self, mbtiles_id, storage_path, zoom, x, y):
+        session = Session()
+        try:
+            tile_row = session.query(vector_tiles.tile_data).filter(
+                vector_tiles.mbtiles_id == mbtiles_id,
+                vector_tiles.zoom_level == zoom,
+                vector_tiles.tile_column == x,
+                vector_tiles.tile_row == y
+            ).first()
+        finally:
+            session.close()
+        return bytes(tile_row[0]) if tile_row else None
+
+    def export(self, mbtiles_id, storage_path, dest_path):
+        session = Session()
+        try:
+            tile_data = session.query(mbtiles.tile_data).filter(mbtiles.id == mbtiles_id).scalar()
+        finally:
+            session.close()
+        if tile_data is None:
+            return False
+        with open(dest_path, 'wb') as f:
+            f.write(tile_data)
+        return True
+
+
+class MBTilesFileStore:
+    name = 'mbtiles'
+
+    def __init__(self, root, pool_size, mmap_size):
+        self.root = root
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        # storage_path -> (connection, lock); evicted connections close once no reader holds them any more
+        self.connections = OrderedDict()
+        self.pool_lock = Lock()
+
+    def full_path(self, storage_path):
+        return os.path.join(self.root, storage_path)
+
+    def save(self, mbtiles_file_path, mbtiles_id, cur):
+        # Content addressed, so identical tilesets (e.g. exported copies) share one file
+        digest = hashlib.sha256()
+        with open(mbtiles_file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        storage_path = os.path.join(sha[:2], f'{sha}.mbtiles')
+        target = self.full_path(storage_path)
+
+        if os.path.exists(target):
+            os.utime(target)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(mbtiles_file_path, tmp_path)
+                os.replace(tmp_path, target)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        return storage_path
+
+    def update_tiles(self, mbtiles_id, storage_path, tiles, mbtiles_file_path, cur):
+        # Stored files are shared by identical tilesets and read as immutable, so the edit is written to a copy of
+        # the file, which the tileset then points at. The old file goes once prune finds it unreferenced
+        new_storage_path = os.path.join(uuid.uuid4().hex[:2], f'{uuid.uuid4().hex}.mbtiles')
+        target = self.full_path(new_storage_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(self.full_path(storage_path), tmp_path)
+            with sqlite3.connect(tmp_path) as tileset:
+                tileset.execute("CREATE TEMP TABLE dirty (zoom_level integer, tile_column integer, tile_row integer)")
+                tileset.executemany("INSERT INTO dirty VALUES (?, ?, ?)", tiles)
+                tileset.execute("DELETE FROM tiles WHERE (zoom_level, tile_column, tile_row) IN (SELECT * FROM dirty)")
+                if mbtiles_file_path is not None:
+                    tileset.execute("ATTACH DATABASE ? AS edited", (mbtiles_file_path,))
+                    tileset.execute("""
+                        INSERT INTO tiles
+                        SELECT e.zoom_level, e.tile_column, e.tile_row, e.tile_data
+                        FROM edited.tiles e JOIN dirty d
+                          ON e.zoom_level = d.zoom_level AND e.tile_column = d.tile_column AND e.tile_row = d.tile_row
+                        """)
+                tileset.commit()
+                if mbtiles_file_path is not None:
+                    tileset.execute("DETACH DATABASE edited")
+            tileset.close()
+            os.replace(tmp_path, target)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return new_storage_path
+
+    def get_connection(self, storage_path):
+        with self.pool_lock:
+            entry = self.connections.get(storage_path)
+            if entry is not None:
+                self.connections.move_to_end(storage_path)
+                return entry
+
+            uri = f"file:{self.full_path(storage_path)}?mode=ro&immutable=1"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            entry = (connection, Lock())
+            self.connections[storage_path] = entry
+            while len(self.connections) > self.pool_size:
+                self.connections.popitem(last=False)
+            return entry
+
+    def drop_connection(self, storage_path):
+        with self.pool_lock:
+            self.connections.pop(storage_path, None)
+
+    def get_tile(self, mbtiles_id, storage_path, zoom, x, y):
+        connection, lock = self.get_connection(storage_path)
+        with lock:
+            tile_row = connection.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (zoom, x, y)
+            ).fetchone()
+        return bytes(tile_row[0]) if tile_row else None
+
+    def export(self, mbtiles_id, storage_path, dest_path):
+        try:
+            shutil.copyfile(self.full_path(storage_path), dest_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def prune(self):
+        # Removes tileset files no mbtiles row points at; recent files are kept since their row may not be committed yet
+        if not os.path.isdir(self.root):
+            return
+        session = Session()
+        try:
+            referenced = {path for path, in session.query(mbtiles.storage_path).filter(mbtiles.storage_path.isnot(None)).distinct()}
+        finally:
+            session.close()
+
+        cutoff = time.time() - TILESET_PRUNE_GRACE
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                storage_path = os.path.relpath(full_path, self.root)
+                if storage_path in referenced:
+                    continue
+                try:
+                    if os.path.getmtime(full_path) < cutoff:
+                        os.remove(full_path)
+                        self.drop_connection(storage_path)
+                        logger.debug(f"Removed unreferenced tileset {storage_path}")
+                except FileNotFoundError:
+                    pass
+
+
+postgres_tile_store = PostgresTileStore()
+mbtiles_file_store = MBTilesFileStore(TILESET_DIR, TILESET_CONNECTION_POOL_SIZE, TILESET_MMAP_SIZE)
+
+def get_tile_store():
+    # Backend new tilesets are written to
+    if TILE_STORE_BACKEND == mbtiles_file_store.name:
+        return mbtiles_file_store
+    return postgres_tile_store
+
+def get_tileset_store(storage_path):
+    # Backend an existing tileset was written to
+    return mbtiles_file_store if storage_path else postgres_tile_store
+
+def prune_tilesets():
+    try:
+        mbtiles_file_store.prune()
+    except Exception as e:
+        logger.warning(f"Could not prune tileset files: {e}")
@@ -3,6 +3,7 @@ from database.sessions import Session
 from werkzeug.security import generate_password_hash
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 from utils.logger_config import logger
+from utils.local_cache import publish_invalidation
 
 
 def get_user_with_id(userid, session=None):
@@ -133,6 +134,7 @@ def add_user_to_organization(user_id, org_id, session):
     if userVal:
         userVal.organization_id = org_id
         session.commit()
+        publish_invalidation('user_org', user_id)
         return True
     return False
 
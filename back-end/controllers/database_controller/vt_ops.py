@@ -1,7 +1,11 @@
 import os
 import psycopg2
 import sqlite3
-from controllers.database_controller.kml_ops import get_kml_data, generate_csv_data
+import hashlib
+import math
+import shutil
+import tempfile
+from controllers.database_controller.kml_ops import iter_kml_data, generate_csv_data
 import json
 import subprocess
 import geopandas
@@ -11,26 +15,50 @@ from psycopg2.extensions import adapt, register_adapter, AsIs
 from psycopg2 import Binary
 from psycopg2.extras import execute_values
 from fastkml import kml
-from utils.settings import DATABASE_URL
+from utils.settings import DATABASE_URL, TILE_CACHE_MAX_BYTES, TILE_CACHE_MAX_ENTRIES, TILESET_CACHE_TTL, TILE_LAYER_CACHE_DIR, TILE_LAYER_CACHE_MAX_FILES, TILE_EDIT_ZOOM_BAND, TILE_WORK_DIR
 from multiprocessing import Lock
+from threading import Thread
+import itertools
+from collections import OrderedDict
 from celery import chain 
 from datetime import datetime
 from database.sessions import ScopedSession, Session
 from database.models import vector_tiles, file, folder, kml_data, fabric_data, mbtiles
 from controllers.celery_controller.celery_config import celery
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import desc
-from .file_ops import get_files_by_type, get_file_with_id, get_files_with_postfix, create_file, update_file_type, get_files_with_prefix, get_file_with_name
+from sqlalchemy import desc, func, or_
+from .file_ops import get_files_by_type, get_file_with_id, get_file_data, get_files_with_postfix, create_file, update_file_type, get_files_with_prefix, get_file_with_name
 from .folder_ops import get_upload_folder, get_export_folder, get_folder_with_id
 from .mbtiles_ops import get_latest_mbtiles, delete_mbtiles, get_mbtiles_with_id
 from .user_ops import get_user_with_id
+from .tile_store import get_tile_store, get_tileset_store, postgres_tile_store, prune_tilesets
 from utils.namingschemes import DATETIME_FORMAT, EXPORT_CSV_NAME_TEMPLATE
 from utils.logger_config import logger
+from utils.local_cache import LRUCache, MISSING, register_invalidation_handler, publish_invalidation
 import uuid
 
 
 db_lock = Lock()
 
+# (mbtiles id, revision, z, x, y) -> gzipped tile bytes, or None for tiles the tileset does not have.
+# A tileset only changes through edits written in place, which bump its revision, so only the folder ->
+# latest (mbtiles id, storage path, revision) mapping needs invalidating
+tile_cache = LRUCache(max_entries=TILE_CACHE_MAX_ENTRIES, max_size=TILE_CACHE_MAX_BYTES)
+latest_mbtiles_cache = LRUCache(max_entries=10000, ttl=TILESET_CACHE_TTL)
+
+def invalidate_tileset(folderid):
+    if folderid is None:
+        latest_mbtiles_cache.clear()
+        tile_cache.clear()
+        return
+    tileset = latest_mbtiles_cache.get(folderid)
+    latest_mbtiles_cache.pop(folderid)
+    if tileset is not MISSING and tileset is not None:
+        tile_cache.discard_where(lambda key: key[0] == tileset[0])
+
+register_invalidation_handler('tileset', invalidate_tileset)
+register_invalidation_handler('folder', invalidate_tileset)
+
 def extract_geometry(placemark):
     geometries = []
     geometries.append(placemark.geometry.__geo_interface__)
@@ -50,7 +78,7 @@ def read_kml(fileid, session):
         raise ValueError(f"No file found with ID {fileid}")
     
     kml_obj = kml.KML()
-    doc = file_record.data
+    doc = get_file_data(fileid, session)
     kml_obj.from_string(doc)
 
 
@@ -82,7 +110,7 @@ def read_geojson(fileid, session):
         raise ValueError(f"No file found with name {file_record.name}")
 
     # Read the GeoJSON data using GeoPandas
-    geojson_data = geopandas.read_file(StringIO(file_record.data.decode()))
+    geojson_data = geopandas.read_file(StringIO(get_file_data(fileid, session).decode()))
 
     # Filter only polygons and linestrings
     desired_geometries = geojson_data[geojson_data.geometry.geom_type.isin(['Polygon', 'LineString', 'MultiPolygon'])]
@@ -104,175 +132,513 @@ def read_geojson(fileid, session):
 
 
 
-def add_values_to_VT(geojson_file_path, mbtiles_file_path, folderid):
-    with sqlite3.connect(mbtiles_file_path) as mb_conn:
-        mb_c = mb_conn.cursor()
-        mb_c.execute(
-            """
-            SELECT zoom_level, tile_column, tile_row, tile_data
-            FROM tiles
-            """
-        )
+def add_values_to_VT(mbtiles_file_path, folderid):
+    tile_store = get_tile_store()
 
-        # Create a new connection to Postgres
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        
-        try:
+    # Create a new connection to Postgres
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("SELECT COUNT(*) FROM mbtiles WHERE folder_id = %s", (folderid,))
+        count = cur.fetchone()[0]
+        cur.execute('SELECT "name" FROM "folder" WHERE id = %s', (folderid,))
+        foldername = cur.fetchone()[0]
+        new_filename = f'{foldername}-{count+1}.mbtiles'
+
+        # The whole-file blob is only kept for tilesets stored as vector_tiles rows
+        mbtiles_data = None
+        if tile_store is postgres_tile_store:
             with open(mbtiles_file_path, 'rb') as file:
                 mbtiles_data = Binary(file.read())
-            
-            cur.execute("SELECT COUNT(*) FROM mbtiles WHERE folder_id = %s", (folderid,))
-            count = cur.fetchone()[0]
-            cur.execute('SELECT "name" FROM "folder" WHERE id = %s', (folderid,))
-            foldername = cur.fetchone()[0]
-            new_filename = f'{foldername}-{count+1}.mbtiles'
-
-            cur.execute("""
-                INSERT INTO mbtiles (tile_data, filename, timestamp, folder_id)
-                VALUES (%s, %s, %s, %s) RETURNING id
-                """, (mbtiles_data, new_filename, datetime.now(), folderid))
-
-            mbt_id = cur.fetchone()[0]
-
-            data = [(row[0], row[1], row[2], Binary(row[3]), mbt_id) for row in mb_c]
-
-            execute_values(cur, """
-                INSERT INTO vector_tiles (zoom_level, tile_column, tile_row, tile_data, mbtiles_id) 
-                VALUES %s
-                """, data)
-
-            # Commit the transaction
-            conn.commit()
-        except psycopg2.Error as e:
-            print(f"Database error occurred: {e}")
-            conn.rollback()
-            return -1
-        except Exception as e:
-            print(f"Unexpected error occurred: {e}")
-            conn.rollback()
-            return -1
-        finally:
-            cur.close()
-            conn.close()
-            os.remove(mbtiles_file_path)
-            os.remove(geojson_file_path)
-    return 1
 
-# def run_tippecanoe_tiles_join(command1, command2, folderid, mbtilepaths):
-    
-#     # run first command
-#     result1 = subprocess.run(command1, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-#     if result1.returncode != 0:
-#         raise Exception(f"Command '{command1}' failed with return code {result1.returncode}")
-
-#     # run second command
-#     result2 = subprocess.run(command2, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-#     if result2.returncode != 0:
-#         raise Exception(f"Command '{command2}' failed with return code {result2.returncode}")
-
-#     # print outputs if any
-#     if result1.stdout:
-#         print("Tippecanoe stdout:", result1.stdout.decode())
-#     if result1.stderr:
-#         print("Tippecanoe stderr:", result1.stderr.decode())
-#     if result2.stdout:
-#         print("Tile-join stdout:", result2.stdout.decode())
-#     if result2.stderr:
-#         print("Tile-join stderr:", result2.stderr.decode())
-
-#     # handle the result
-#     add_values_to_VT(mbtilepaths[0], folderid)
-#     for i in range(1, len(mbtilepaths)):
-#         os.remove(mbtilepaths[i])
-        
-#     return result2.returncode
-
-# def tiles_join(geojson_data, folderid, session):
-#     try:
-#         mbtile_file = get_latest_mbtiles(folderid, session)
-#         # Save the .mbtiles file temporarily on the disk
-#         with open(mbtile_file.filename, 'wb') as f:
-#             f.write(mbtile_file.tile_data)
-#         # Save the geojson_data to a .geojson file
-#         with open('data.geojson', 'w') as f:
-#             json.dump(geojson_data, f)
-#         # Use tippecanoe to create a new .mbtiles file from the geojson_data
-#         command1 = "tippecanoe -o new.mbtiles -P -z 16 --drop-densest-as-needed data.geojson --force --use-attribute-for-id=location_id"
-
-#         # Use tile-join to merge the new .mbtiles file with the existing one
-#         command2 = f"tile-join -o merged.mbtiles {mbtile_file.filename} new.mbtiles"
-
-#         run_tippecanoe_tiles_join(command1, command2, 1, ["./merged.mbtiles", mbtile_file.filename, "./new.mbtiles"])
-        
-#     except SQLAlchemyError as e:
-#         print(f"Error occurred during query: {str(e)}")
-#         return None
-
-def run_tippecanoe(command, folderid, geojsonpath, mbtilepath):
-    result = subprocess.run(command, shell=True, check=True, stderr=subprocess.PIPE)
+        cur.execute("""
+            INSERT INTO mbtiles (tile_data, filename, timestamp, folder_id)
+            VALUES (%s, %s, %s, %s) RETURNING id
+            """, (mbtiles_data, new_filename, datetime.now(), folderid))
+
+        mbt_id = cur.fetchone()[0]
+
+        storage_path = tile_store.save(mbtiles_file_path, mbt_id, cur)
+        if storage_path:
+            cur.execute("UPDATE mbtiles SET storage_path = %s WHERE id = %s", (storage_path, mbt_id))
+
+        # Commit the transaction
+        conn.commit()
+        publish_invalidation('tileset', folderid)
+    except psycopg2.Error as e:
+        print(f"Database error occurred: {e}")
+        conn.rollback()
+        return -1
+    except Exception as e:
+        print(f"Unexpected error occurred: {e}")
+        conn.rollback()
+        return -1
+    finally:
+        cur.close()
+        conn.close()
+        os.remove(mbtiles_file_path)
+
+    prune_tilesets()
+    return mbt_id
+
+# Every layer is tiled into the same "data" layer name, so tile-join merges them back into one layer per tile
+TILE_MAX_ZOOM = 16
+# Largest tile served, enforced by tippecanoe per layer and checked again after the layers are joined
+TILE_MAX_BYTES = 3000000
+TIPPECANOE_LAYER_OPTIONS = ['--base-zoom=7', '-P', f'--maximum-tile-bytes={TILE_MAX_BYTES}', '-z', str(TILE_MAX_ZOOM), '--drop-densest-as-needed',
+                            '--force', '--use-attribute-for-id=location_id', '--layer=data']
+# tippecanoe's default tile buffer, as a fraction of a tile
+TILE_BUFFER = 5 / 256
+# Bump when the tiling options or the feature properties change, so cached layers are not reused
+TILE_LAYER_VERSION = 1
+# Points are tiled in partitions of one tile of this zoom each from this zoom up, so an upload only retiles the
+# partitions whose points changed; the zooms below come from one overview layer of all points
+TILE_POINT_PARTITION_ZOOM = 8
+# Partition spool files kept open at once while the folder's points are read
+TILE_POINT_SPOOL_MAX_OPEN = 256
+
+def read_tippecanoe_output(stream, progress, messages):
+    # Drains tippecanoe's stderr so it never blocks on a full pipe; --json-progress lines go to progress(percent)
+    last_percent = None
+    for line in stream:
+        line = line.decode(errors='replace').strip()
+        if not line:
+            continue
+        try:
+            percent = json.loads(line).get('progress')
+        except (ValueError, AttributeError):
+            percent = None
+        if percent is None:
+            messages.append(line)
+            continue
+        if progress is not None and int(percent) != last_percent:
+            last_percent = int(percent)
+            try:
+                progress(percent)
+            except Exception as e:
+                logger.warning(f"Could not report tiling progress: {e}")
+
+def run_tippecanoe(features, mbtilepath, extra_options=(), progress=None):
+    # Features are piped to tippecanoe as newline-delimited GeoJSON while it tiles, so serialization overlaps
+    # with tiling and no intermediate GeoJSON is written. Returns the number of features, 0 if nothing was tiled
+    return run_tippecanoe_lines((json.dumps(feature).encode() + b'\n' for feature in features), mbtilepath, extra_options, progress)
+
+def run_tippecanoe_lines(lines, mbtilepath, extra_options=(), progress=None):
+    # Same as run_tippecanoe for features already serialized as GeoJSON lines
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return 0
+
+    command = ['tippecanoe', '-o', mbtilepath, '-t', os.path.dirname(mbtilepath), '--json-progress', '--progress-interval=1',
+               *TIPPECANOE_LAYER_OPTIONS, *extra_options]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    messages = []
+    reader = Thread(target=read_tippecanoe_output, args=(process.stderr, progress, messages), daemon=True)
+    reader.start()
+
+    count = 0
+    try:
+        for line in itertools.chain([first], lines):
+            process.stdin.write(line)
+            count += 1
+        process.stdin.close()
+    except BrokenPipeError:
+        # tippecanoe exited early, its return code and stderr say why
+        pass
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        returncode = process.wait()
+        reader.join()
+
+    if messages:
+        logger.debug("Tippecanoe stderr: " + '\n'.join(messages))
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr='\n'.join(messages))
+    return count
+
+def run_tile_join(layerpaths, mbtilepath):
+    # tile-join can only drop whole tiles above 500K, which would leave holes in the map; TILE_MAX_BYTES is enforced
+    # by the callers through largest_tile_size instead
+    result = subprocess.run(['tile-join', '-o', mbtilepath, '--force', '--no-tile-size-limit', *layerpaths], check=True, stderr=subprocess.PIPE)
 
     if result.stderr:
-        print("Tippecanoe stderr:", result.stderr.decode())
-
-    add_values_to_VT(geojsonpath, mbtilepath, folderid)
-    return result.returncode 
-
-
-def create_tiles(geojson_array, folderid, session):
-    network_data = get_kml_data(folderid, session)
-    if network_data:
-        point_geojson = {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "properties": {
-                        "location_id": point['location_id'],
-                        "served": point['served'],
-                        "address": point['address'],
-                        "wireless": point['wireless'],
-                        'lte': point['lte'],
-                        'network_coverages': point['coveredLocations'],
-                        'maxDownloadNetwork': point['maxDownloadNetwork'],
-                        'maxDownloadSpeed': point['maxDownloadSpeed'],
-                        'bsl': point['bsl'],
-                        "feature_type": "Point"
-                    },
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [point['longitude'], point['latitude']]
-                    }
-                }
-                for point in network_data
-            ]
+        print("Tile-join stderr:", result.stderr.decode())
+    return result.returncode
+
+def largest_tile_size(mbtilepath):
+    with sqlite3.connect(mbtilepath) as tileset:
+        return tileset.execute("SELECT coalesce(max(length(tile_data)), 0) FROM tiles").fetchone()[0]
+
+def get_layer_cache_path(key, suffix='.mbtiles'):
+    return os.path.join(TILE_LAYER_CACHE_DIR, f'{key}{suffix}')
+
+def get_cached_layer(key):
+    # Returns (hit, path); path is None for layers cached as having no features
+    for suffix in ('.mbtiles', '.empty'):
+        path = get_layer_cache_path(key, suffix)
+        if os.path.exists(path):
+            os.utime(path)
+            return True, path if suffix == '.mbtiles' else None
+    return False, None
+
+def cache_layer(key, tile, workdir):
+    # tile(layer path) tiles the layer and returns its number of features
+    layer_path = os.path.join(workdir, f'{key}.mbtiles')
+    if not tile(layer_path):
+        open(get_layer_cache_path(key, '.empty'), 'w').close()
+        return None
+
+    cache_path = get_layer_cache_path(key)
+    try:
+        os.replace(layer_path, cache_path)
+    except OSError:
+        # The work directory may be on another filesystem (e.g. tmpfs), copy next to the cache so the rename stays atomic
+        fd, tmp_path = tempfile.mkstemp(dir=TILE_LAYER_CACHE_DIR, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(layer_path, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    return cache_path
+
+def prune_layer_cache():
+    try:
+        layers = [entry for entry in os.scandir(TILE_LAYER_CACHE_DIR)
+                  if entry.is_file() and entry.name.endswith(('.mbtiles', '.empty'))]
+        layers.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in layers[TILE_LAYER_CACHE_MAX_FILES:]:
+            os.remove(entry.path)
+    except OSError as e:
+        logger.warning(f"Could not prune tile layer cache: {e}")
+
+def point_features(network_data):
+    return (
+        {
+            "type": "Feature",
+            "properties": {
+                "location_id": point['location_id'],
+                "served": point['served'],
+                "address": point['address'],
+                "wireless": point['wireless'],
+                'lte': point['lte'],
+                'network_coverages': point['coveredLocations'],
+                'maxDownloadNetwork': point['maxDownloadNetwork'],
+                'maxDownloadSpeed': point['maxDownloadSpeed'],
+                'bsl': point['bsl'],
+                "feature_type": "Point"
+            },
+            "geometry": {
+                "type": "Point",
+                "coordinates": [point['longitude'], point['latitude']]
+            }
         }
-        
-        # print(geojson_array)
-        point_geojson["features"].extend(geojson for geojson in geojson_array)
-        uuid_str = str(uuid.uuid4())
-        unique_geojson_filename = f"data{uuid_str}.geojson"
-
-        with open(unique_geojson_filename, 'w') as f:
-            json.dump(point_geojson, f)
-        
-        outputFile = f"output{uuid_str}.mbtiles"
-        command = f"tippecanoe -o {outputFile} --base-zoom=7 -P --maximum-tile-bytes=3000000 -z 16 --drop-densest-as-needed {unique_geojson_filename} --force --use-attribute-for-id=location_id --layer=data"
-        run_tippecanoe(command, folderid, unique_geojson_filename, outputFile)
-
-def retrieve_tiles(zoom, x, y, folderid):
-    session = Session()
+        for point in network_data
+    )
+
+def located(network_data):
+    return (point for point in network_data if point['longitude'] is not None and point['latitude'] is not None)
+
+def point_partition(point):
+    n = 2 ** TILE_POINT_PARTITION_ZOOM
+    x, y = lonlat_to_tile_fraction(point['longitude'], point['latitude'], TILE_POINT_PARTITION_ZOOM)
+    return min(max(int(x), 0), n - 1), min(max(int(y), 0), n - 1)
+
+def spool_points(folderid, workdir, session):
+    # One pass over the folder's merged points writes each partition's features to its own GeoJSON lines file and
+    # hashes them. Returns {partition: (spool path, content hash)}
+    paths = {}
+    digests = {}
+    spools = OrderedDict()
+    try:
+        for point in located(iter_kml_data(folderid, session)):
+            partition = point_partition(point)
+            line = json.dumps(next(point_features([point]))).encode() + b'\n'
+            spool = spools.get(partition)
+            if spool is None:
+                if partition not in paths:
+                    paths[partition] = os.path.join(workdir, 'points-{}-{}.json'.format(*partition))
+                    digests[partition] = hashlib.sha256()
+                spool = spools[partition] = open(paths[partition], 'ab')
+                if len(spools) > TILE_POINT_SPOOL_MAX_OPEN:
+                    spools.popitem(last=False)[1].close()
+            else:
+                spools.move_to_end(partition)
+            spool.write(line)
+            digests[partition].update(line)
+    finally:
+        for spool in spools.values():
+            spool.close()
+    return {partition: (paths[partition], digests[partition].hexdigest()) for partition in paths}
+
+def spooled_lines(paths):
+    for path in paths:
+        with open(path, 'rb') as spool:
+            yield from spool
+
+def build_point_layers(folderid, workdir, session, progress=None):
+    # Partitions whose points are unchanged reuse their cached layer; the overview layer below the partition zoom
+    # is retiled from all points whenever any of them changed. Returns [(layer path, rebuilt)]
+    spooled = spool_points(folderid, workdir, session)
+    if not spooled:
+        return []
+
+    partitions = sorted(spooled)
+    overview_hash = hashlib.sha256(''.join(spooled[partition][1] for partition in partitions).encode()).hexdigest()
+    overview_key = hashlib.sha256(f'{TILE_LAYER_VERSION}:points:overview:{overview_hash}'.encode()).hexdigest()
+    overview_options = ['-z', str(TILE_POINT_PARTITION_ZOOM - 1)]
+    builds = [(overview_key, [spooled[partition][0] for partition in partitions], overview_options)]
+    for x, y in partitions:
+        path, content_hash = spooled[(x, y)]
+        key = hashlib.sha256(f'{TILE_LAYER_VERSION}:points:{TILE_POINT_PARTITION_ZOOM}/{x}/{y}:{content_hash}'.encode()).hexdigest()
+        builds.append((key, [path], ['-Z', str(TILE_POINT_PARTITION_ZOOM)]))
+
+    layers = []
+    misses = []
+    for key, paths, options in builds:
+        hit, path = get_cached_layer(key)
+        if hit:
+            layers.append((path, False))
+        else:
+            misses.append((key, paths, options))
+
+    for index, (key, paths, options) in enumerate(misses):
+        build_progress = None
+        if progress is not None:
+            build_progress = lambda percent, index=index: progress((index + percent / 100) * 100 / len(misses))
+        tile = lambda layer_path, paths=paths, options=options, build_progress=build_progress: run_tippecanoe_lines(
+            spooled_lines(paths), layer_path, options, build_progress)
+        layers.append((cache_layer(key, tile, workdir), True))
+    return layers
+
+def build_coverage_layer(fileid, filename, content_hash, workdir, session):
+    # Coverage polygons only depend on the file itself, so unchanged files are never retiled
+    key = hashlib.sha256(f'{TILE_LAYER_VERSION}:coverage:{filename}:{content_hash}'.encode()).hexdigest()
+
+    hit, path = get_cached_layer(key)
+    if hit:
+        return path, False
+    if filename.endswith('.kml'):
+        features = read_kml(fileid, session)
+    else:
+        features = read_geojson(fileid, session)
+    return cache_layer(key, lambda layer_path: run_tippecanoe(features, layer_path), workdir), True
+
+
+def build_coverage_layers(folderid, workdir, session):
+    # Hash the file contents in the database instead of pulling every blob into the worker
+    coverage_files = (session.query(file.id, file.name, func.md5(file.data))
+                      .filter(file.folder_id == folderid, or_(file.name.endswith('.kml'), file.name.endswith('.geojson')))
+                      .order_by(file.id)
+                      .all())
+    return [build_coverage_layer(fileid, filename, content_hash, workdir, session)
+            for fileid, filename, content_hash in coverage_files]
+
+
+def folder_features(folderid, session):
+    coverage_files = (session.query(file.id, file.name)
+                      .filter(file.folder_id == folderid, or_(file.name.endswith('.kml'), file.name.endswith('.geojson')))
+                      .order_by(file.id)
+                      .all())
+    return itertools.chain(
+        point_features(located(iter_kml_data(folderid, session))),
+        *((read_kml(fileid, session) if filename.endswith('.kml') else read_geojson(fileid, session)) for fileid, filename in coverage_files))
+
+def create_tiles(folderid, session, progress=None):
+    # progress(percent) is called as tippecanoe tiles the folder's points
+    os.makedirs(TILE_LAYER_CACHE_DIR, exist_ok=True)
+    os.makedirs(TILE_WORK_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(dir=TILE_WORK_DIR)
+    try:
+        layers = build_point_layers(folderid, workdir, session, progress)
+        if not layers:
+            return
+        layers.extend(build_coverage_layers(folderid, workdir, session))
+
+        layer_paths = [path for path, _ in layers if path is not None]
+        logger.info(f"Retiled {sum(rebuilt for _, rebuilt in layers)} of {len(layers)} layers for folder {folderid}")
+
+        outputFile = os.path.join(workdir, f"output{uuid.uuid4()}.mbtiles")
+        run_tile_join(layer_paths, outputFile)
+        if largest_tile_size(outputFile) > TILE_MAX_BYTES:
+            # Layers that each fit can still add up past the limit; tile everything in one run so tippecanoe thins it
+            logger.warning(f"Joined tiles of folder {folderid} exceed {TILE_MAX_BYTES} bytes, tiling all layers together")
+            run_tippecanoe(folder_features(folderid, session), outputFile)
+        add_values_to_VT(outputFile, folderid)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        prune_layer_cache()
+
+def lonlat_to_tile_fraction(lon, lat, zoom):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+def tile_to_lonlat_bounds(x, y, zoom):
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tiles_in_bounds(bounds, zoom, buffer=TILE_BUFFER):
+    # XYZ tiles whose area, including tippecanoe's buffer, intersects the lon/lat bounds
+    west, south, east, north = bounds
+    n = 2 ** zoom
+    x0, y0 = lonlat_to_tile_fraction(west, north, zoom)
+    x1, y1 = lonlat_to_tile_fraction(east, south, zoom)
+    xs = range(max(math.floor(x0 - buffer), 0), min(math.floor(x1 + buffer), n - 1) + 1)
+    ys = range(max(math.floor(y0 - buffer), 0), min(math.floor(y1 + buffer), n - 1) + 1)
+    return {(x, y) for x in xs for y in ys}
+
+def tiles_extent(tiles, zoom):
+    extents = [tile_to_lonlat_bounds(x, y, zoom) for x, y in tiles]
+    return (min(e[0] for e in extents), min(e[1] for e in extents),
+            max(e[2] for e in extents), max(e[3] for e in extents))
+
+def update_tileset(mbtiles_id, tiles, mbtiles_file_path, folderid):
+    # Writes the edited tiles into the stored tileset and bumps its revision. Returns False if the tileset is gone
+    conn = psycopg2.connect(DATABASE_URL)
+    cur = conn.cursor()
     try:
-       
-        tile = session.query(vector_tiles.tile_data).join(mbtiles, vector_tiles.mbtiles_id == mbtiles.id).filter(
-            vector_tiles.zoom_level == int(zoom),
-            vector_tiles.tile_column == int(x),
-            vector_tiles.tile_row == int(y),
-            mbtiles.folder_id == folderid
-        ).order_by(desc(mbtiles.timestamp)).first()
-       
-
-        return tile
+        # Concurrent edits of the same tileset are applied one after the other
+        cur.execute("SELECT storage_path FROM mbtiles WHERE id = %s FOR UPDATE", (mbtiles_id,))
+        row = cur.fetchone()
+        if row is None:
+            return False
+        storage_path = get_tileset_store(row[0]).update_tiles(mbtiles_id, row[0], tiles, mbtiles_file_path, cur)
+        cur.execute("UPDATE mbtiles SET storage_path = %s, revision = revision + 1 WHERE id = %s", (storage_path, mbtiles_id))
+        conn.commit()
+        publish_invalidation('tileset', folderid)
+        return True
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        session.close()
- 
+        cur.close()
+        conn.close()
+
+def copy_tiles(src_path, dest_path, tiles):
+    # Writes the given (zoom, column, TMS row) tiles of an MBTiles file, plus its metadata, to a new MBTiles file
+    with sqlite3.connect(dest_path) as dest:
+        dest.execute("CREATE TABLE metadata (name text, value text)")
+        dest.execute("CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+        dest.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+        dest.execute("ATTACH DATABASE ? AS src", (src_path,))
+        dest.execute("INSERT INTO metadata SELECT name, value FROM src.metadata")
+        dest.execute("CREATE TEMP TABLE wanted (zoom_level integer, tile_column integer, tile_row integer)")
+        dest.executemany("INSERT INTO wanted VALUES (?, ?, ?)", tiles)
+        dest.execute("""
+            INSERT INTO tiles
+            SELECT t.zoom_level, t.tile_column, t.tile_row, t.tile_data
+            FROM src.tiles t JOIN wanted w
+              ON t.zoom_level = w.zoom_level AND t.tile_column = w.tile_column AND t.tile_row = w.tile_row
+            """)
+        dest.commit()
+        dest.execute("DETACH DATABASE src")
+
+def retile_edited_region(folderid, polygonfeatures, session, progress=None):
+    # Rebuilds only the tiles touched by the edit polygons and writes them into the current tileset.
+    # Coverage layers do not change on marker edits, so only the point layer is retiled, zoom band by zoom band
+    # over the dirty tiles, and merged with the cached coverage layer tiles at the same addresses
+    current = (session.query(mbtiles.id, mbtiles.storage_path)
+               .filter(mbtiles.folder_id == folderid)
+               .order_by(desc(mbtiles.timestamp))
+               .first())
+    geometries = [shape(feature['geometry']) for feature in polygonfeatures if feature.get('geometry')]
+    if current is None or not geometries:
+        delete_mbtiles(folderid, session)
+        create_tiles(folderid, session, progress)
+        return
+
+    edit_bounds = (min(g.bounds[0] for g in geometries), min(g.bounds[1] for g in geometries),
+                   max(g.bounds[2] for g in geometries), max(g.bounds[3] for g in geometries))
+
+    os.makedirs(TILE_LAYER_CACHE_DIR, exist_ok=True)
+    os.makedirs(TILE_WORK_DIR, exist_ok=True)
+    workdir = tempfile.mkdtemp(dir=TILE_WORK_DIR)
+    try:
+        dirty = {zoom: tiles_in_bounds(edit_bounds, zoom) for zoom in range(TILE_MAX_ZOOM + 1)}
+        dirty_tms = [(zoom, x, 2 ** zoom - 1 - y) for zoom, tiles in dirty.items() for x, y in tiles]
+
+        layer_subsets = []
+        band_starts = range(0, TILE_MAX_ZOOM + 1, TILE_EDIT_ZOOM_BAND)
+        for band_index, band_start in enumerate(band_starts):
+            band_end = min(band_start + TILE_EDIT_ZOOM_BAND - 1, TILE_MAX_ZOOM)
+            # Clip a tile of the band's deepest zoom beyond the dirty area, so edge tiles keep their buffered points
+            margin = 360.0 / 2 ** band_end
+            west, south, east, north = tiles_extent(dirty[band_start], band_start)
+            clip = (max(west - margin, -180.0), max(south - margin, -85.0511), min(east + margin, 180.0), min(north + margin, 85.0511))
+
+            band_path = os.path.join(workdir, f'points-{band_start}.mbtiles')
+            band_progress = None
+            if progress is not None:
+                band_progress = lambda percent, band_index=band_index: progress((band_index + percent / 100) * 100 / len(band_starts))
+            if run_tippecanoe(point_features(iter_kml_data(folderid, session, bounds=clip)), band_path,
+                              ['-Z', str(band_start), '-z', str(band_end), '--clip-bounding-box=' + ','.join(str(c) for c in clip)],
+                              band_progress):
+                layer_subsets.append(band_path)
+
+        for index, (layer_path, _) in enumerate(build_coverage_layers(folderid, workdir, session)):
+            if layer_path is not None:
+                subset_path = os.path.join(workdir, f'coverage-{index}.mbtiles')
+                copy_tiles(layer_path, subset_path, dirty_tms)
+                layer_subsets.append(subset_path)
+
+        merged_path = None
+        if layer_subsets:
+            merged_path = os.path.join(workdir, 'dirty.mbtiles')
+            run_tile_join(layer_subsets, merged_path)
+
+        if ((merged_path is not None and largest_tile_size(merged_path) > TILE_MAX_BYTES) or
+                not update_tileset(current.id, dirty_tms, merged_path, folderid)):
+            delete_mbtiles(folderid, session)
+            create_tiles(folderid, session, progress)
+            return
+        logger.info(f"Retiled {len(dirty_tms)} edited tiles for folder {folderid}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def get_latest_tileset(folderid):
+    # (mbtiles id, storage path, revision) of the folder's current tileset, or None
+    tileset = latest_mbtiles_cache.get(folderid)
+    if tileset is MISSING:
+        session = Session()
+        try:
+            tileset = (session.query(mbtiles.id, mbtiles.storage_path, mbtiles.revision)
+                       .filter(mbtiles.folder_id == folderid)
+                       .order_by(desc(mbtiles.timestamp))
+                       .first())
+        finally:
+            session.close()
+        tileset = tuple(tileset) if tileset else None
+        latest_mbtiles_cache.set(folderid, tileset)
+    return tileset
+
+def get_latest_tileset_version(folderid):
+    # Changes whenever the tiles served for the folder do, e.g. for ETags
+    tileset = get_latest_tileset(folderid)
+    return f'{tileset[0]}.{tileset[2]}' if tileset else None
+
+def retrieve_tiles(zoom, x, y, folderid):
+    tileset = get_latest_tileset(folderid)
+    if tileset is None:
+        return None
+
+    mbtiles_id, storage_path, revision = tileset
+    key = (mbtiles_id, revision, int(zoom), int(x), int(y))
+    tile = tile_cache.get(key)
+    if tile is MISSING:
+        tile = get_tileset_store(storage_path).get_tile(mbtiles_id, storage_path, key[2], key[3], key[4])
+        tile_cache.set(key, tile)
+
+    return tile
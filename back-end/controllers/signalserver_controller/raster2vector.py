@@ -1,42 +1,103 @@
 from PIL import Image, ImageFilter
+from io import BytesIO
+from xml.sax.saxutils import escape
+from rasterio import features, transform
+from shapely.geometry import shape
 import numpy as np
+import geopandas
 import math
 
-def smooth_edges(input_image_path, output_image_path, smoothing_iterations=1):
+def _window_filter_1d(src, dst, kernel_radius, axis, op):
+    # dst = op over a window of 2 * kernel_radius + 1 pixels along axis, windows are truncated at the edges
+    dst[...] = src
+    for k in range(1, kernel_radius + 1):
+        if axis == 0:
+            op(dst[:-k], src[k:], out=dst[:-k])
+            op(dst[k:], src[:-k], out=dst[k:])
+        else:
+            op(dst[:, :-k], src[:, k:], out=dst[:, :-k])
+            op(dst[:, k:], src[:, :-k], out=dst[:, k:])
+
+def _window_filter(channel, scratch, kernel_radius, op):
+    # Separable square-window min/max filter, written back into channel. Only pixels whose whole
+    # window lies inside the image change, so the kernel_radius-wide border keeps its values.
+    r = kernel_radius
+    border = [channel[:r].copy(), channel[-r:].copy(), channel[:, :r].copy(), channel[:, -r:].copy()]
+
+    _window_filter_1d(channel, scratch, r, 1, op)
+    _window_filter_1d(scratch, channel, r, 0, op)
+
+    channel[:, :r], channel[:, -r:] = border[2], border[3]
+    channel[:r], channel[-r:] = border[0], border[1]
+
+def smooth_alpha_channel(alpha_channel, smoothing_iterations=1, kernel_radius=1):
+    # Morphological opening (erode then dilate) of a 2D array in place, using a
+    # (2 * kernel_radius + 1) square kernel and one scratch buffer of the same size.
+    if kernel_radius < 1 or min(alpha_channel.shape) <= 2 * kernel_radius:
+        return alpha_channel
+
+    scratch = np.empty_like(alpha_channel)
+    for _ in range(smoothing_iterations):
+        # Erode
+        _window_filter(alpha_channel, scratch, kernel_radius, np.minimum)
+        # Dilate
+        _window_filter(alpha_channel, scratch, kernel_radius, np.maximum)
+
+    return alpha_channel
+
+def smooth_edges(input_image_path, output_image_path, smoothing_iterations=1, kernel_radius=1):
     with Image.open(input_image_path) as img:
         img = img.convert('RGBA')
         # Convert to numpy array for morphological operations
         img_array = np.array(img)
-        alpha_channel = img_array[:, :, 3]
-
-        # Perform morphological operations
-        for _ in range(smoothing_iterations):
-            # Erode
-            eroded = np.copy(alpha_channel)
-            eroded[1:-1, 1:-1] = np.minimum.reduce([
-                alpha_channel[:-2, 1:-1], alpha_channel[2:, 1:-1],
-                alpha_channel[1:-1, :-2], alpha_channel[1:-1, 2:],
-                alpha_channel[:-2, :-2], alpha_channel[:-2, 2:],
-                alpha_channel[2:, :-2], alpha_channel[2:, 2:],
-                alpha_channel[1:-1, 1:-1]
-            ])
-
-            # Dilate
-            dilated = np.copy(eroded)
-            dilated[1:-1, 1:-1] = np.maximum.reduce([
-                eroded[:-2, 1:-1], eroded[2:, 1:-1],
-                eroded[1:-1, :-2], eroded[1:-1, 2:],
-                eroded[:-2, :-2], eroded[:-2, 2:],
-                eroded[2:, :-2], eroded[2:, 2:],
-                eroded[1:-1, 1:-1]
-            ])
-
-            alpha_channel = dilated
-
-        # Apply the smoothed alpha channel back to the image
-        img_array[:, :, 3] = alpha_channel
-        smoothed_img = Image.fromarray(img_array)
-        smoothed_img.save(output_image_path, 'PNG')
+
+    # Work on a contiguous copy of the alpha channel, strided access is several times slower
+    alpha_channel = np.ascontiguousarray(img_array[:, :, 3])
+    smooth_alpha_channel(alpha_channel, smoothing_iterations, kernel_radius)
+    img_array[:, :, 3] = alpha_channel
+
+    smoothed_img = Image.fromarray(img_array)
+    smoothed_img.save(output_image_path, 'PNG')
+
+def vectorize_raster(image_data, north, south, east, west, smoothing_iterations=1, kernel_radius=1):
+    # Turn a stored coverage PNG into a GeoDataFrame of the polygons covered by its
+    # non-transparent pixels, georeferenced from the raster's N/S/E/W bounds
+    with Image.open(BytesIO(image_data)) as img:
+        alpha_channel = np.array(img.convert('RGBA'))[:, :, 3]
+
+    smooth_alpha_channel(alpha_channel, smoothing_iterations, kernel_radius)
+    height, width = alpha_channel.shape
+    raster_transform = transform.from_bounds(float(west), float(south), float(east), float(north), width, height)
+
+    covered = (alpha_channel > 0).astype(np.uint8)
+    polygons = [
+        shape(geometry)
+        for geometry, _ in features.shapes(covered, mask=covered.astype(bool), transform=raster_transform)
+    ]
+    return geopandas.GeoDataFrame(geometry=polygons, crs="EPSG:4326")
+
+def coverage_to_kml(coverage, name):
+    # Minimal KML document with one Placemark per polygon, readable by fiona and fastkml
+    def ring_to_kml(ring):
+        return ' '.join(f'{x},{y}' for x, y in ring.coords)
+
+    placemarks = []
+    for polygon in coverage.geometry:
+        inner = ''.join(
+            f'<innerBoundaryIs><LinearRing><coordinates>{ring_to_kml(ring)}</coordinates></LinearRing></innerBoundaryIs>'
+            for ring in polygon.interiors
+        )
+        placemarks.append(
+            f'<Placemark><Polygon><outerBoundaryIs><LinearRing><coordinates>{ring_to_kml(polygon.exterior)}</coordinates></LinearRing></outerBoundaryIs>{inner}</Polygon></Placemark>'
+        )
+
+    return (
+        '<?xml version="1.0" encoding="utf-8" ?>\n'
+        '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+        f'<Document><Folder><name>{escape(name)}</name>\n'
+        + '\n'.join(placemarks) +
+        '\n</Folder></Document></kml>\n'
+    )
 
 def compute_bounds(latitude, longitude, range_km):
     # Calculate Upper Left and Lower Right coords
@@ -1,24 +1,31 @@
 from PIL import Image, ImageFilter
+import numpy as np
 import xml.etree.ElementTree as ET
 import zipfile
 import os
+from io import BytesIO
 
-def load_loss_to_color_mapping(lcf_file_path, floor_loss_rate=None):
+def parse_loss_to_color_mapping(lines, floor_loss_rate=None):
     mapping = {}
     filtered_lines = []
 
+    for line in lines:
+        parts = line.strip().split(':')
+        if len(parts) == 2:
+            loss, color = parts
+            loss = int(loss)
+
+            if floor_loss_rate is None or loss <= floor_loss_rate:
+                r, g, b = map(int, color.split(','))
+                mapping[loss] = (r, g, b)
+                filtered_lines.append(line)
+
+    return mapping, filtered_lines
+
+def load_loss_to_color_mapping(lcf_file_path, floor_loss_rate=None):
     # Read and filter the data
     with open(lcf_file_path, 'r') as file:
-        for line in file:
-            parts = line.strip().split(':')
-            if len(parts) == 2:
-                loss, color = parts
-                loss = int(loss)
-
-                if floor_loss_rate is None or loss <= floor_loss_rate:
-                    r, g, b = map(int, color.split(','))
-                    mapping[loss] = (r, g, b)
-                    filtered_lines.append(line)
+        mapping, filtered_lines = parse_loss_to_color_mapping(file, floor_loss_rate)
 
     # Truncate the file by writing the filtered data
     if floor_loss_rate is not None:
@@ -28,34 +35,68 @@ def load_loss_to_color_mapping(lcf_file_path, floor_loss_rate=None):
     return mapping
 
 
-def filter_image_by_loss(input_image_path, floor_loss_rate, lcf_file_path, output_image_path):
-    loss_to_color_mapping = load_loss_to_color_mapping(lcf_file_path, floor_loss_rate)
-    with Image.open(input_image_path) as img:
-        img = img.convert('RGBA')
-        pixels = img.load()
+def pack_rgb(rgb_array):
+    # Pack the r, g, b channels of an (..., 3) array into a single uint32 per pixel
+    rgb_array = rgb_array.astype(np.uint32)
+    return (rgb_array[..., 0] << 16) | (rgb_array[..., 1] << 8) | rgb_array[..., 2]
 
-        for i in range(img.width):
-            for j in range(img.height):
-                r, g, b, a = pixels[i, j]
-                # Determine the loss rate based on the color in the loss to color mapping
-                loss_rate = next((loss for loss, color in loss_to_color_mapping.items() if color == (r, g, b)), None)
-                # If the loss rate is higher than the floor loss rate or not defined, set to transparent
-                if loss_rate is None or loss_rate > floor_loss_rate:
-                    pixels[i, j] = (255, 255, 255, 0)
+def build_loss_lookup(loss_to_color_mapping, floor_loss_rate):
+    # Sorted packed-RGB keys of every color whose loss rate is within the floor loss rate
+    colors = [color for loss, color in loss_to_color_mapping.items() if loss <= floor_loss_rate]
+    if not colors:
+        return np.empty(0, dtype=np.uint32)
+    return np.unique(pack_rgb(np.array(colors, dtype=np.uint32)))
 
-        img.save(output_image_path, 'PNG')
+TRANSPARENT_PIXEL = (255, 255, 255, 0)
+OVERLAY_PIXEL = (0, 194, 255, 76)
 
-def generate_transparent_image(input_image_path, output_image_path):
+def read_rgba_array(input_image_path):
     with Image.open(input_image_path) as img:
-        img = img.convert('RGBA')
-        pixels = img.load()
+        return np.array(img.convert('RGBA'))
 
-        for i in range(img.width):
-            for j in range(img.height):
-                if pixels[i, j] != (255, 255, 255, 0):
-                    pixels[i, j] = (0, 194, 255, 76)
+def write_rgba_array(img_array, output_image_path):
+    Image.fromarray(img_array, 'RGBA').save(output_image_path, 'PNG')
 
-        img.save(output_image_path, 'PNG')
+def encode_rgba_array(img_array):
+    output = BytesIO()
+    write_rgba_array(img_array, output)
+    return output.getvalue()
+
+def apply_loss_filter(img_array, loss_lookup):
+    # Set every pixel whose color is not in the lookup to transparent, in place on an RGBA array
+    packed = pack_rgb(img_array[..., :3])
+    if loss_lookup.size:
+        idx = np.searchsorted(loss_lookup, packed)
+        idx[idx == loss_lookup.size] = 0
+        keep = loss_lookup[idx] == packed
+    else:
+        keep = np.zeros(packed.shape, dtype=bool)
+    img_array[~keep] = TRANSPARENT_PIXEL
+    return img_array
+
+def build_transparent_overlay(img_array):
+    # Recolor every non-transparent pixel of an RGBA array, leaving the input array untouched
+    visible = np.any(img_array != TRANSPARENT_PIXEL, axis=-1)
+    overlay = np.empty_like(img_array)
+    overlay[...] = TRANSPARENT_PIXEL
+    overlay[visible] = OVERLAY_PIXEL
+    return overlay
+
+def filter_image_by_loss(input_image_path, floor_loss_rate, lcf_file_path, output_image_path):
+    loss_to_color_mapping = load_loss_to_color_mapping(lcf_file_path, floor_loss_rate)
+    loss_lookup = build_loss_lookup(loss_to_color_mapping, floor_loss_rate)
+    img_array = read_rgba_array(input_image_path)
+
+    apply_loss_filter(img_array, loss_lookup)
+    write_rgba_array(img_array, output_image_path)
+    return img_array
+
+def generate_transparent_image(input_image_path, output_image_path, img_array=None):
+    # Pass img_array to reuse an already decoded image instead of reading input_image_path again
+    if img_array is None:
+        img_array = read_rgba_array(input_image_path)
+
+    write_rgba_array(build_transparent_overlay(img_array), output_image_path)
 
 def read_rasterkmz(kmz_filename):
     try: 
@@ -75,4 +116,30 @@ def read_rasterkmz(kmz_filename):
                     'wbound': west
                 }
     except Exception as e:
-        return {'error': str(e)}
\ No newline at end of file
+        return {'error': str(e)}
+
+
+class SignalServerRaster:
+    """Post-process the .png/.lcf/.kmz output of one SignalServer run in memory, without writing intermediate files."""
+
+    def __init__(self, outfile_name, floor_loss_rate):
+        self.outfile_name = outfile_name
+        self.floor_loss_rate = floor_loss_rate
+        self.loss_color_mapping = None
+        self.bounds = None
+        self.image_data = None
+        self.transparent_image_data = None
+
+    def process(self):
+        self.bounds = read_rasterkmz(self.outfile_name + '.kmz')
+        if 'error' in self.bounds:
+            raise ValueError(f"Could not read raster bounds from {self.outfile_name}.kmz: {self.bounds['error']}")
+
+        with open(self.outfile_name + '.lcf', 'r') as lcf_file:
+            self.loss_color_mapping, _ = parse_loss_to_color_mapping(lcf_file, self.floor_loss_rate)
+
+        img_array = read_rgba_array(self.outfile_name + '.png')
+        apply_loss_filter(img_array, build_loss_lookup(self.loss_color_mapping, self.floor_loss_rate))
+        self.image_data = encode_rgba_array(img_array)
+        self.transparent_image_data = encode_rgba_array(build_transparent_overlay(img_array))
+        return self
@@ -1,8 +1,7 @@
-from sqlalchemy import Column, Integer, Float, Boolean, String, LargeBinary, DateTime, JSON, Date, Table
+from sqlalchemy import Column, Integer, BigInteger, Float, Boolean, String, LargeBinary, DateTime, JSON, Date, Table
 from database.base import Base
-from sqlalchemy import ForeignKey, UniqueConstraint
-from sqlalchemy.orm import relationship
-from datetime import datetime
+from sqlalchemy import ForeignKey, UniqueConstraint, Index, func
+from sqlalchemy.orm import relationship, deferred
 
 class organization(Base):
     __tablename__ = 'organization'
@@ -11,10 +10,11 @@ class organization(Base):
     name = Column(String(100), unique=True, nullable=False)
     provider_id = Column(Integer)
     brand_name = Column(String(50))
-    users = relationship('user', back_populates='organization')
-    folders = relationship('folder', back_populates='organization', cascade='all, delete')
-    towers = relationship('tower', back_populates='organization', cascade='all, delete')
-    celerytasksinfo = relationship('celerytaskinfo', back_populates='organization', cascade='all, delete')
+    # Deletes cascade in the database (ON DELETE CASCADE / SET NULL), the ORM does not load children to delete them
+    users = relationship('user', back_populates='organization', passive_deletes=True)
+    folders = relationship('folder', back_populates='organization', cascade='all, delete', passive_deletes=True)
+    towers = relationship('tower', back_populates='organization', cascade='all, delete', passive_deletes=True)
+    celerytasksinfo = relationship('celerytaskinfo', back_populates='organization', cascade='all, delete', passive_deletes=True)
 
 class user(Base):
     __tablename__ = 'user'
@@ -24,7 +24,7 @@ class user(Base):
     password = Column(String(256))
     is_admin = Column(Boolean, default=False)
     verified = Column(Boolean, default=False)
-    organization_id = Column(Integer, ForeignKey('organization.id'))
+    organization_id = Column(Integer, ForeignKey('organization.id', ondelete='SET NULL'))
     organization = relationship('organization', back_populates='users')
 
     
@@ -42,7 +42,7 @@ class celerytaskinfo(Base):
     user_email = Column(String, nullable=False)
     folder_deadline = Column(Date)
     files_changed = Column(String, nullable=True)
-    organization_id = Column(Integer, ForeignKey('organization.id'))
+    organization_id = Column(Integer, ForeignKey('organization.id', ondelete='CASCADE'))
     organization = relationship('organization', back_populates='celerytasksinfo')
 
 class tower(Base):
@@ -50,12 +50,12 @@ class tower(Base):
 
     id = Column(Integer, primary_key=True)
     tower_name = Column(String, nullable=False)
-    organization_id = Column(Integer, ForeignKey('organization.id'), nullable=False)
+    organization_id = Column(Integer, ForeignKey('organization.id', ondelete='CASCADE'), nullable=False)
 
     # Relationship to TowerInfo and RasterData models (assuming they exist)
     organization = relationship('organization', back_populates='towers')
-    tower_info = relationship('towerinfo', back_populates='tower', uselist=False, cascade='all, delete')
-    raster_data = relationship('rasterdata', back_populates='tower', uselist=False, cascade='all, delete')
+    tower_info = relationship('towerinfo', back_populates='tower', uselist=False, cascade='all, delete', passive_deletes=True)
+    raster_data = relationship('rasterdata', back_populates='tower', uselist=False, cascade='all, delete', passive_deletes=True)
 
 class towerinfo(Base):
     __tablename__ = 'towerinfo'
@@ -78,8 +78,9 @@ class rasterdata(Base):
     __tablename__ = 'rasterdata'
 
     id = Column(Integer, primary_key=True)
-    image_data = Column(LargeBinary)  # for storing binary image data
-    transparent_image_data = Column(LargeBinary)
+    # Blobs are deferred so rows can be listed without reading the images; rasterdata_ops.get_rasterdata_image reads them
+    image_data = deferred(Column(LargeBinary))  # for storing binary image data
+    transparent_image_data = deferred(Column(LargeBinary))
     loss_color_mapping = Column(JSON)
     north_bound = Column(String)
     south_bound = Column(String)
@@ -99,45 +100,10 @@ class folder(Base): #filing, will change the name later for less confusion when
     deadline = Column(Date) #This deadline makes it a filing for the current period
     organization_id = Column(Integer, ForeignKey('organization.id', ondelete='CASCADE'))
     organization = relationship('organization', back_populates='folders')
-    files = relationship('file', back_populates='folder', cascade='all, delete')
-    mbtiles = relationship('mbtiles', back_populates='folder', cascade='all, delete')
-    editfiles = relationship('editfile', back_populates='folder', cascade='all,delete')
-
-    def copy(self, session, export=True, name=None, type=None, deadline=None):
-        name = name if name is not None else self.name
-        type = type if type is not None else self.type
-        new_folder = folder(name=name, type=type, organization_id=self.organization_id, deadline=deadline)
-        session.add(new_folder)
-        session.flush()  # To generate an ID for the new folder
-        
-
-        new_file_mapping = {}
-        new_editfile_mapping = {}
-
-        # Copy related files, mbtiles
-        for file in self.files:
-            if not export and file.name.endswith('.csv'):
-                continue
-            new_file = file.copy(session=session, new_folder_id=new_folder.id, export=export)
-            new_file_mapping[file.id] = new_file.id
-        for edit_file in self.editfiles:
-            new_edit_file = edit_file.copy(session=session, new_folder_id=new_folder.id)
-            new_editfile_mapping[edit_file.id] = new_edit_file.id
-        
-        # Only copy 
-        if export:
-            for mbtile in self.mbtiles:
-                mbtile.copy(session=session, new_folder_id=new_folder.id)
-
-        for file in self.files:
-            for link in file.editfile_links:
-                if link.editfile_id in new_editfile_mapping:  # Ensure the editfile was copied
-                    new_link = file_editfile_link(
-                        file_id=new_file_mapping[file.id],
-                        editfile_id=new_editfile_mapping[link.editfile_id]
-                    )
-                    session.add(new_link)
-        return new_folder
+    files = relationship('file', back_populates='folder', cascade='all, delete', passive_deletes=True)
+    mbtiles = relationship('mbtiles', back_populates='folder', cascade='all, delete', passive_deletes=True)
+    editfiles = relationship('editfile', back_populates='folder', cascade='all,delete', passive_deletes=True)
+
 
 class file_editfile_link(Base):
     __tablename__ = 'file_editfile_link'
@@ -149,12 +115,17 @@ class file_editfile_link(Base):
     file = relationship("file", back_populates="editfile_links")
     editfile = relationship("editfile", back_populates="file_links")
 
+    __table_args__ = (
+        Index('ix_file_editfile_link_file_id', 'file_id'),
+        Index('ix_file_editfile_link_editfile_id', 'editfile_id'),
+    )
+
 class file(Base):
     __tablename__ = 'file'
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    data = Column(LargeBinary)
+    data = deferred(Column(LargeBinary))  # read with file_ops.get_file_data
     folder_id = Column(Integer, ForeignKey('folder.id', ondelete='CASCADE'))
     timestamp = Column(DateTime) 
     type = Column(String)
@@ -165,98 +136,25 @@ class file(Base):
     category = Column(String)
     computed = Column(Boolean, default=False)
     folder = relationship('folder', back_populates='files')
-    fabric_data = relationship('fabric_data', back_populates='file', cascade='all, delete')  # Use fabric_data instead of data_entries
-    kml_data = relationship('kml_data', back_populates='file', cascade='all, delete')
-    editfile_links = relationship("file_editfile_link", back_populates="file")
+    fabric_data = relationship('fabric_data', back_populates='file', cascade='all, delete', passive_deletes=True)  # Use fabric_data instead of data_entries
+    kml_data = relationship('kml_data', back_populates='file', cascade='all, delete', passive_deletes=True)
+    editfile_links = relationship("file_editfile_link", back_populates="file", passive_deletes=True)
+
+    __table_args__ = (
+        Index('ix_file_folder_id_name', 'folder_id', 'name'),
+    )
 
-    
-    def copy(self, session, export, new_folder_id=None):
-        new_file = file(name=self.name, 
-                        data=self.data, 
-                        folder_id=new_folder_id,
-                        timestamp=datetime.now(), 
-                        type=self.type,
-                        maxDownloadSpeed=self.maxDownloadSpeed,
-                        maxUploadSpeed=self.maxUploadSpeed,
-                        techType=self.techType,
-                        latency=self.latency,
-                        category=self.category,
-                        )
-        session.add(new_file)
-        session.flush()
-        
-        if export:
-            fabric_data_copies = []
-            for fabric_entry in self.fabric_data:
-                fabric_data_copy = {
-                    "location_id":fabric_entry.location_id,
-                    "address_primary" : fabric_entry.address_primary,
-                    "city" : fabric_entry.city,
-                    "state" : fabric_entry.state,
-                    "zip_code" : fabric_entry.zip_code,
-                    "zip_suffix" : fabric_entry.zip_suffix,
-                    "unit_count" : fabric_entry.unit_count,
-                    "bsl_flag" : fabric_entry.bsl_flag,
-                    "building_type_code" : fabric_entry.building_type_code,
-                    "land_use_code" : fabric_entry.land_use_code,
-                    "address_confidence_code" : fabric_entry.address_confidence_code,
-                    "country_geoid" : fabric_entry.country_geoid,
-                    "block_geoid" : fabric_entry.block_geoid,
-                    "h3_9" : fabric_entry.h3_9,
-                    "latitude" : fabric_entry.latitude,
-                    "longitude" : fabric_entry.longitude,
-                    "fcc_rel" : fabric_entry.fcc_rel,
-                    "file_id" : new_file.id
-                }
-                fabric_data_copies.append(fabric_data_copy)
-
-            kml_data_copies = []
-            for kml_entry in self.kml_data:
-                kml_data_copy = {
-                    "location_id":kml_entry.location_id,
-                    "served" : kml_entry.served,
-                    "wireless" : kml_entry.wireless,
-                    "lte" : kml_entry.lte,
-                    "coveredLocations" : kml_entry.coveredLocations,
-                    "maxDownloadNetwork" : kml_entry.maxDownloadNetwork,
-                    "maxDownloadSpeed" : kml_entry.maxDownloadSpeed,
-                    "maxUploadSpeed" : kml_entry.maxUploadSpeed,
-                    "techType" : kml_entry.techType,
-                    "address_primary" : kml_entry.address_primary,
-                    "longitude" : kml_entry.longitude,
-                    "latitude" : kml_entry.latitude,
-                    "latency" : kml_entry.latency,
-                    "category" : kml_entry.category,
-                    "file_id": new_file.id
-                }
-                kml_data_copies.append(kml_data_copy)
-
-            session.bulk_insert_mappings(fabric_data, fabric_data_copies)
-            session.bulk_insert_mappings(kml_data, kml_data_copies)
-
-        return new_file
-    
 
 class editfile(Base):
     __tablename__ = 'editfile'
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    data = Column(LargeBinary)
+    data = deferred(Column(LargeBinary))  # read with editfile_ops.get_editfile_data
     folder_id = Column(Integer, ForeignKey('folder.id', ondelete='CASCADE'))
     timestamp = Column(DateTime) 
     folder = relationship('folder', back_populates='editfiles')
-    file_links = relationship("file_editfile_link", back_populates="editfile")
+    file_links = relationship("file_editfile_link", back_populates="editfile", passive_deletes=True)
 
-    def copy(self, session, new_folder_id=None):
-        new_edit_file = editfile(name=self.name, 
-                        data=self.data, 
-                        folder_id=new_folder_id,
-                        timestamp=datetime.now(), 
-                        )
-        session.add(new_edit_file)
-        session.flush()
-
-        return new_edit_file
 
 class fabric_data(Base):
     __tablename__ = 'fabric_data'
@@ -281,6 +179,14 @@ class fabric_data(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)  # Unique primary key
     file = relationship('file', back_populates='fabric_data')
 
+    __table_args__ = (
+        Index('ix_fabric_data_file_id_location_id', 'file_id', 'location_id'),
+        Index('ix_fabric_data_address_primary_trgm', 'address_primary',
+              postgresql_using='gin', postgresql_ops={'address_primary': 'gin_trgm_ops'}),
+        Index('ix_fabric_data_location_point', func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326),
+              postgresql_using='gist'),
+    )
+
 class fabric_data_temp(Base):
     __tablename__ = 'fabric_data_temp'
     location_id = Column(Integer, primary_key=True)
@@ -322,36 +228,25 @@ class kml_data(Base):
     latency = Column(Integer)
     category = Column(String)
 
+    __table_args__ = (
+        Index('ix_kml_data_file_id_location_id', 'file_id', 'location_id'),
+        Index('ix_kml_data_location_point', func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326),
+              postgresql_using='gist'),
+    )
+
 
 class mbtiles(Base):
     __tablename__ = 'mbtiles'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    tile_data = Column(LargeBinary)
+    tile_data = deferred(Column(LargeBinary))  # read by the postgres tile store's export; cleared once tiles are edited
     filename = Column(String)
     timestamp = Column(DateTime)
+    storage_path = Column(String)  # MBTiles file under TILESET_DIR; tiles are in vector_tiles when unset
+    revision = Column(Integer, nullable=False, server_default='0')  # bumped whenever edited tiles are written in place
     folder_id = Column(Integer, ForeignKey('folder.id', ondelete='CASCADE'))
     folder = relationship('folder', back_populates='mbtiles')
-    vector_tiles = relationship('vector_tiles', back_populates='mbtiles', cascade='all, delete')
-
-    def copy(self, session, new_folder_id):
-        new_mbtile = mbtiles(filename=self.filename, 
-                              tile_data=self.tile_data, 
-                              timestamp=datetime.now(), 
-                              folder_id=new_folder_id)
-        session.add(new_mbtile)
-        session.flush()
-
-        vector_tile_copies = []
-        for vector_tile in self.vector_tiles:
-            vector_tile_copy = {
-                "zoom_level" : vector_tile.zoom_level,
-                "tile_column" : vector_tile.tile_column,
-                "tile_row" : vector_tile.tile_row,
-                "tile_data" : vector_tile.tile_data,
-                "mbtiles_id" : new_mbtile.id
-            }
-            vector_tile_copies.append(vector_tile_copy)
-        session.bulk_insert_mappings(vector_tiles, vector_tile_copies)
+    vector_tiles = relationship('vector_tiles', back_populates='mbtiles', cascade='all, delete', passive_deletes=True)
+
 
 class vector_tiles(Base):
     __tablename__ = 'vector_tiles'
@@ -363,6 +258,34 @@ class vector_tiles(Base):
     mbtiles_id = Column(Integer, ForeignKey('mbtiles.id', ondelete='CASCADE'))
     mbtiles = relationship('mbtiles', back_populates='vector_tiles')
 
+    __table_args__ = (
+        Index('ix_vector_tiles_mbtiles_id_zoom_level_tile_column_tile_row', 'mbtiles_id', 'zoom_level', 'tile_column', 'tile_row'),
+    )
+
+class staged_blob(Base):
+    # Uploads and generated files handed to Celery tasks by reference, stored in chunks so they never have to be
+    # held in memory in one piece. Chunked uploads also keep their owner and declared size; sha256 is set once complete
+    __tablename__ = 'staged_blob'
+    id = Column(String(32), primary_key=True)
+    owner_id = Column(Integer, ForeignKey('user.id', ondelete='CASCADE'))
+    name = Column(String)
+    size = Column(BigInteger, nullable=False)
+    sha256 = Column(String(64))
+    updated_at = Column(DateTime, nullable=False)
+    chunks = relationship('staged_blob_chunk', back_populates='blob', cascade='all, delete', passive_deletes=True)
+
+    __table_args__ = (
+        Index('ix_staged_blob_owner_id', 'owner_id'),
+        Index('ix_staged_blob_updated_at', 'updated_at'),
+    )
+
+class staged_blob_chunk(Base):
+    __tablename__ = 'staged_blob_chunk'
+    blob_id = Column(String(32), ForeignKey('staged_blob.id', ondelete='CASCADE'), primary_key=True)
+    byte_offset = Column(BigInteger, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    blob = relationship('staged_blob', back_populates='chunks')
+
 class ChallengeLocations(Base):
     __tablename__ = 'challenge_locations'
 
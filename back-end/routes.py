@@ -1,9 +1,9 @@
-import logging, os, base64, uuid, io
+import logging, os, base64, uuid, io, zlib
 from zipfile import ZipFile
 from logging.handlers import RotatingFileHandler
 from logging import getLogger
 from werkzeug.security import check_password_hash
-from flask import jsonify, request, make_response, send_file, Response
+from flask import jsonify, request, make_response, send_file, Response, stream_with_context
 from flask_jwt_extended.exceptions import NoAuthorizationError
 from flask_jwt_extended import (
     JWTManager,
@@ -17,7 +17,7 @@ from datetime import datetime, timedelta
 import shortuuid
 from celery.result import AsyncResult
 from celery import chain
-from utils.settings import DATABASE_URL, COOKIE_EXP_TIME, backend_port, IN_PRODUCTION
+from utils.settings import DATABASE_URL, COOKIE_EXP_TIME, backend_port, IN_PRODUCTION, SERVED_DATA_MAX_PAGE_SIZE, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_SIZE
 from database.sessions import Session
 from controllers.database_controller import organization_ops, fabric_ops, kml_ops, user_ops, vt_ops, file_ops, folder_ops, mbtiles_ops, challenge_ops, editfile_ops, celerytaskinfo_ops
 from utils.flask_app import app, mail
@@ -27,9 +27,11 @@ from utils.namingschemes import DATETIME_FORMAT, DATE_FORMAT, EXPORT_CSV_NAME_TE
 from controllers.signalserver_controller.signalserver_command_builder import runsig_command_builder
 from controllers.database_controller.tower_ops import create_tower, get_tower_with_towername
 from controllers.database_controller.towerinfo_ops import create_towerinfo
-from controllers.database_controller.rasterdata_ops import create_rasterdata
+from controllers.database_controller.rasterdata_ops import create_rasterdata, get_rasterdata_id_for_tower, get_rasterdata_image
 from controllers.signalserver_controller.read_towerinfo import read_tower_csv
 from utils.logger_config import logger
+from utils.local_cache import start_invalidation_listener, publish_invalidation
+from controllers.database_controller.staged_blob_ops import stage_stream, create_upload, get_upload, append_upload_chunk, complete_upload, discard_staged_blobs, UploadOffsetMismatch, UploadConflict, UploadQuotaExceeded
 import json
 from shapely.geometry import shape
 from flask_mail import Message
@@ -42,24 +44,221 @@ db_password = os.environ.get("POSTGRES_PASSWORD")
 db_host = os.getenv('DB_HOST')
 db_port = os.getenv('DB_PORT')
 
+start_invalidation_listener()
+
+# Tile and raster URLs are not versioned, so clients revalidate every time; a matching ETag costs no blob read
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+def not_modified(etag, cache_control):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+SERVED_DATA_FIELDS = ['location_id', 'address', 'latitude', 'longitude', 'bsl', 'served', 'wireless', 'lte',
+                      'coveredLocations', 'maxDownloadNetwork', 'maxDownloadSpeed']
+
+def parse_bbox(value):
+    # west,south,east,north in degrees
+    if not value:
+        return None
+    bounds = [float(coordinate) for coordinate in value.split(',')]
+    if len(bounds) != 4 or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        raise ValueError('bbox must be west,south,east,north')
+    return tuple(bounds)
+
+def parse_fields(value):
+    if not value:
+        return SERVED_DATA_FIELDS
+    fields = value.split(',')
+    unknown = [field for field in fields if field not in SERVED_DATA_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def buffered(chunks, size=64 * 1024):
+    buffer = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 @app.route("/api/served-data/<folderid>", methods=['GET'])
 @jwt_required()
 def get_number_records(folderid):
-    folderid = int(folderid)
-    session = Session()
+    # Streams the folder's served locations, optionally restricted to a bbox, a page of location ids
+    # (limit rows after the location id given as cursor) and a subset of fields.
+    # format=ndjson returns one location per line; otherwise a JSON array, wrapped as
+    # {"data": [...], "next_cursor": ...} when limit is given
     try:
         identity = get_jwt_identity()
+        folderid = int(folderid)
         if folderid < 0:
             return jsonify({'error': 'Filling ID is invalid'}), 400
-        else:
-            if not folder_ops.folder_belongs_to_organization(folderid, identity['id'], session):
-                return jsonify({'error': 'You are accessing a filing not belong to your organization'}), 400
+        if not folder_ops.cached_folder_belongs_to_organization(folderid, identity['id']):
+            return jsonify({'error': 'You are accessing a filing not belong to your organization'}), 400
 
-            return jsonify(kml_ops.get_kml_data(folderid=folderid, session=session)), 200
+        try:
+            bounds = parse_bbox(request.args.get('bbox'))
+            fields = parse_fields(request.args.get('fields'))
+            cursor = request.args.get('cursor', type=int)
+            limit = request.args.get('limit', type=int)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if limit is not None:
+            limit = max(1, min(limit, SERVED_DATA_MAX_PAGE_SIZE))
+        ndjson = request.args.get('format') == 'ndjson'
+    except NoAuthorizationError:
+        return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
+
+    def generate():
+        session = Session()
+        try:
+            rows = kml_ops.iter_kml_data(folderid, session, bounds=bounds, after=cursor, limit=limit)
+            if ndjson:
+                for row in rows:
+                    yield (json.dumps({field: row[field] for field in fields}) + '\n').encode()
+                return
+
+            yield b'{"data": [' if limit is not None else b'['
+            count = 0
+            last_location_id = None
+            for row in rows:
+                yield (b',' if count else b'') + json.dumps({field: row[field] for field in fields}).encode()
+                count += 1
+                last_location_id = row['location_id']
+            if limit is None:
+                yield b']'
+            else:
+                next_cursor = last_location_id if count == limit else None
+                yield b'], "next_cursor": ' + json.dumps(next_cursor).encode() + b'}'
+        except Exception as e:
+            # The status line is already sent, the client sees a truncated body
+            logger.error(f"Error streaming served data of folder {folderid}: {e}")
+            raise
+        finally:
+            session.close()
+
+    compress = 'gzip' in request.accept_encodings
+    body = buffered(generate())
+    if compress:
+        body = gzipped(body)
+    response = Response(stream_with_context(body), mimetype='application/x-ndjson' if ndjson else 'application/json')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Chunked uploads: POST /api/uploads with the file's name and size, PUT each chunk to /api/uploads/<id>?offset=<n>
+# with its SHA-256 in X-Chunk-Sha256, then POST /api/uploads/<id>/complete. After an interruption GET /api/uploads/<id>
+# tells where to resume. Completed uploads are submitted with their uploadId in fileData instead of a file part
+@app.route('/api/uploads', methods=['POST'])
+@jwt_required()
+def create_chunked_upload():
+    try:
+        identity = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        name = data.get('name')
+        size = data.get('size')
+        if not name or not isinstance(size, int) or size < 0:
+            return jsonify({'status': 'error', 'message': "A file name and size are required"}), 400
+        if os.path.splitext(name)[1] not in ['.csv', '.kml', '.geojson']:
+            return jsonify({'status': 'error', 'message': "Invalid file extension. Allowed extensions are .csv, .kml, and .geojson"}), 400
+        if size > UPLOAD_MAX_SIZE:
+            return jsonify({'status': 'error', 'message': f'Files must be at most {UPLOAD_MAX_SIZE} bytes'}), 413
+
+        try:
+            upload_id = create_upload(identity['id'], name, size)
+        except UploadQuotaExceeded as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 413
+        return jsonify({'status': 'success', 'upload_id': upload_id, 'offset': 0, 'chunk_size': UPLOAD_CHUNK_SIZE}), 200
+    except NoAuthorizationError:
+        return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@jwt_required()
+def get_chunked_upload(upload_id):
+    try:
+        identity = get_jwt_identity()
+        upload = get_upload(upload_id, identity['id'])
+        if upload is None:
+            return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+        return jsonify({'status': 'success', 'upload_id': upload_id, 'offset': upload['offset'], 'size': upload['size'],
+                        'completed': upload['ref'] is not None}), 200
+    except NoAuthorizationError:
+        return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@jwt_required()
+def put_upload_chunk(upload_id):
+    try:
+        identity = get_jwt_identity()
+        upload = get_upload(upload_id, identity['id'])
+        if upload is None:
+            return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+        if upload['ref'] is not None:
+            return jsonify({'status': 'error', 'message': 'Upload is already completed', 'offset': upload['offset']}), 409
+
+        offset = request.args.get('offset', type=int)
+        sha256 = request.headers.get('X-Chunk-Sha256', '').lower()
+        if offset is None or not sha256:
+            return jsonify({'status': 'error', 'message': 'offset and X-Chunk-Sha256 are required'}), 400
+        if request.content_length is None or request.content_length > UPLOAD_CHUNK_SIZE:
+            return jsonify({'status': 'error', 'message': f'Chunks must be at most {UPLOAD_CHUNK_SIZE} bytes'}), 413
+        if offset + request.content_length > upload['size']:
+            return jsonify({'status': 'error', 'message': 'Chunk goes past the end of the file'}), 400
+
+        try:
+            new_offset = append_upload_chunk(upload_id, offset, request.get_data(cache=False), sha256)
+        except UploadOffsetMismatch as e:
+            return jsonify({'status': 'error', 'message': str(e), 'offset': e.offset}), 409
+        except UploadConflict as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'status': 'success', 'offset': new_offset}), 200
+    except NoAuthorizationError:
+        return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@jwt_required()
+def complete_chunked_upload(upload_id):
+    try:
+        identity = get_jwt_identity()
+        upload = get_upload(upload_id, identity['id'])
+        if upload is None:
+            return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+
+        try:
+            ref = complete_upload(upload_id)
+        except UploadOffsetMismatch as e:
+            return jsonify({'status': 'error', 'message': 'Upload is missing chunks', 'offset': e.offset}), 409
+        except UploadConflict as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 409
+
+        expected_sha256 = (request.get_json(silent=True) or {}).get('sha256')
+        if expected_sha256 and expected_sha256.lower() != ref['sha256']:
+            discard_staged_blobs([ref])
+            return jsonify({'status': 'error', 'message': 'Uploaded file does not match its checksum, please upload it again'}), 400
+        return jsonify({'status': 'success', 'upload_id': upload_id, 'sha256': ref['sha256'], 'size': ref['size']}), 200
     except NoAuthorizationError:
         return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
-    finally:
-        session.close()
 
 @app.route('/api/submit-data/<folderid>', methods=['POST', 'GET'])
 @jwt_required()
@@ -69,15 +268,12 @@ def submit_data(folderid):
         identity = get_jwt_identity()
         folderid = int(folderid)
         
-        if 'file' not in request.files:
-            return jsonify({'status': "error", 'message': "no file uploaded"}), 400
-
         files = request.files.getlist('file')
-        if len(files) <= 0:
+        file_data_list = request.form.getlist('fileData')
+        if len(file_data_list) <= 0:
             return jsonify({'status': "error", 'message': "no file uploaded"}), 400
 
         operation_detail = "Added more files to a filing"
-        file_data_list = request.form.getlist('fileData')
         filenames = []
         for file_data_str in file_data_list:
             try:
@@ -110,8 +306,22 @@ def submit_data(folderid):
         if not userVal.organization_id:
             return jsonify({'status': 'error', 'message': "Create or join an organization to start working on a filing"}), 400
         import_folder_id = int(request.form.get('importFolder'))
-        # Prepare data for the task
-        file_contents = [(f.filename, base64.b64encode(f.read()).decode('utf-8'), data) for f, data in zip(files, file_data_list)]
+        # Files sent through the chunked upload endpoints are already staged, the others come as multipart parts
+        multipart_files = iter(files)
+        file_sources = []
+        for data in file_data_list:
+            upload_id = json.loads(data).get('uploadId')
+            if upload_id:
+                upload = get_upload(upload_id, identity['id'], session)
+                if upload is None or upload['ref'] is None:
+                    return jsonify({'status': "error", 'message': "Upload not found or not completed"}), 400
+                file_sources.append((json.loads(data)['name'], upload['ref'], data))
+            else:
+                f = next(multipart_files, None)
+                if f is None:
+                    return jsonify({'status': "error", 'message': "no file uploaded"}), 400
+                file_sources.append((f.filename, f, data))
+
         if folderid == -1:
             deadline = request.form.get('deadline')
             if not deadline:
@@ -122,10 +332,19 @@ def submit_data(folderid):
                 deadline_date = datetime.strptime(deadline, '%Y-%m-%d').date()
             except ValueError:
                 return jsonify({'status': "error", "message": "invalid deadline format"}), 400
-            
+
+            if import_folder_id != -1 and not folder_ops.folder_belongs_to_organization(import_folder_id, identity['id'], session):
+                return jsonify({'status': 'error', "message": 'Operation failed because you are accessing a filing not belong to your organization'}), 400
+        elif not folder_ops.folder_belongs_to_organization(folderid, identity['id'], session):
+            return jsonify({'status': 'error', "message": 'Operation failed because you are accessing a filing not belong to your organization'}), 400
+
+        # Prepare data for the task once the request is valid, the files are staged in the database and the task
+        # only gets references to them
+        file_contents = [(filename, source if isinstance(source, dict) else stage_stream(source.stream, identity['id'], filename), data)
+                         for filename, source, data in file_sources]
+
+        if folderid == -1:
             if import_folder_id != -1:
-                if not folder_ops.folder_belongs_to_organization(import_folder_id, identity['id'], session):
-                    return jsonify({'status': 'error', "message": 'Operation failed because you are accessing a filing not belong to your organization'}), 400
                 # Asynchronous copy and create new folder with deadline
                 logger.info("In operation 3 of upload: create a new filing by importing from previous filings")
                 task_chain = chain(
@@ -153,8 +372,6 @@ def submit_data(folderid):
             
         else:
             logger.info("In operation 1 of upload: adding more files to a filing")
-            if not folder_ops.folder_belongs_to_organization(folderid, identity['id'], session):
-                return jsonify({'status': 'error', "message": 'Operation failed because you are accessing a filing not belong to your organization'}), 400
             task_chain = chain(
                 add_files_to_folder.s(folderid, file_contents),
                 process_data.si(folderid=folderid, operation=1)
@@ -458,6 +675,7 @@ def create_organization():
         user.organization_id = new_org.id
         user.is_admin = True
         session.commit()
+        publish_invalidation('user_org', user.id)
 
         return jsonify({'status': 'success', 'message': 'Organization created successfully!'}), 200
     except NoAuthorizationError:
@@ -556,6 +774,7 @@ def exit_organization():
         
         user.organization_id = None
         session.commit()
+        publish_invalidation('user_org', identity['id'])
 
         return jsonify({'status': 'success', 'message': 'Exited organization successfully'}), 200
     
@@ -706,26 +925,33 @@ def serve_tile_with_folderid(folder_id, zoom, x, y):
     
     identity = get_jwt_identity()
 
-
-    session = Session()
-    if not folder_ops.folder_belongs_to_organization(folder_id, identity['id'], session):
-        session.close()
+    if not folder_ops.cached_folder_belongs_to_organization(folder_id, identity['id']):
         return jsonify({'status': 'error', 'message': 'You are accessing a filing not belong to your organization'}), 400
-    session.close()
 
     zoom = int(zoom)
     x = int(x)
     y = int(y)
     y = (2**zoom - 1) - y
 
+    tileset_version = vt_ops.get_latest_tileset_version(folder_id)
+    if tileset_version is None:
+        return Response('No tile found', status=404)
+
+    etag = f"tile-{tileset_version}-{zoom}-{x}-{y}"
+    response = not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    if response is not None:
+        return response
+
     tile = vt_ops.retrieve_tiles(zoom, x, y, folder_id)
 
     if tile is None:
         return Response('No tile found', status=404)
 
-    response = make_response(bytes(tile[0]))    
+    response = make_response(tile)
     response.headers['Content-Type'] = 'application/x-protobuf'
-    response.headers['Content-Encoding'] = 'gzip'  
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    response.set_etag(etag)
     return response
 
 
@@ -1195,6 +1421,20 @@ def compute_wireless_coverage():
     except NoAuthorizationError:
         return jsonify({'status': 'error', 'message': 'Please login to your account'}), 401
 
+def send_raster_image(raster_id, transparent, session):
+    # Raster data is recreated rather than updated when a tower is re-run, so its id versions the image
+    etag = f"raster-{raster_id}-transparent" if transparent else f"raster-{raster_id}"
+    response = not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    if response is not None:
+        return response
+
+    image_io = io.BytesIO(get_rasterdata_image(raster_id, transparent, session))
+    image_io.seek(0)
+    response = send_file(image_io, mimetype='image/png', etag=False)
+    response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/get-raster-image/<string:towername>', methods=['GET'])
 @jwt_required()
 def get_raster_image(towername):
@@ -1210,12 +1450,9 @@ def get_raster_image(towername):
             logger.debug('tower not found under towername')
             return jsonify({'error': 'File not found'}), 404
 
-        rasterData = towerVal.raster_data
-        if rasterData:
-            image_io = io.BytesIO(rasterData.image_data)
-            image_io.seek(0)
-            response = send_file(image_io, mimetype='image/png')
-            return response
+        raster_id = get_rasterdata_id_for_tower(towerVal.id, session)
+        if raster_id:
+            return send_raster_image(raster_id, False, session)
         else:
             return jsonify({'status': 'error', 'message': 'Raster data not found'}), 404
     except NoAuthorizationError:
@@ -1238,12 +1475,9 @@ def get_transparent_raster_image(towername):
             logger.debug('tower not found under towername')
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
 
-        rasterData = towerVal.raster_data
-        if rasterData:
-            image_io = io.BytesIO(rasterData.transparent_image_data)
-            image_io.seek(0)
-            response = send_file(image_io, mimetype='image/png')
-            return response
+        raster_id = get_rasterdata_id_for_tower(towerVal.id, session)
+        if raster_id:
+            return send_raster_image(raster_id, True, session)
         else:
             return jsonify({'status': 'error', 'message': 'Raster data not found'}), 404
     except NoAuthorizationError:
@@ -1341,7 +1575,7 @@ def download_export(fileid):
         fileVal = file_ops.get_file_with_id(fileid=fileid, session=session)
         if not fileVal:
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
-        downfile = io.BytesIO(fileVal.data)
+        downfile = io.BytesIO(file_ops.get_file_data(fileVal.id, session))
         downfile.seek(0)
         return send_file(
                 downfile,
@@ -1396,7 +1630,7 @@ def download_kmlfile(kml_filename):
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
 
         
-        downfile = io.BytesIO(fileVal.data)
+        downfile = io.BytesIO(file_ops.get_file_data(fileVal.id, session))
         downfile.seek(0)
         return send_file(
                 downfile,
@@ -1440,7 +1674,7 @@ def get_edit_geojson(fileid):
             return jsonify({'status': 'error', 'message': 'File not found'}), 404
         
         # Decode the binary data to string assuming it's stored in UTF-8 encoded JSON format
-        geojson_data = json.loads(editfile.data.decode('utf-8'))
+        geojson_data = json.loads(editfile_ops.get_editfile_data(editfile.id, session).decode('utf-8'))
         return jsonify(geojson_data), 200
     except FileNotFoundError:
         return jsonify({'status': 'error', 'message': 'File not found'}), 404
@@ -1465,7 +1699,7 @@ def get_edit_geojson_centroid(fileid):
             return jsonify({'status': 'error', 'message': 'File not found'}), 400
 
         # Decode the binary data to a JSON object
-        geojson_object = json.loads(editfile.data.decode('utf-8'))
+        geojson_object = json.loads(editfile_ops.get_editfile_data(editfile.id, session).decode('utf-8'))
         
         # Calculate the centroid of the polygon
         polygon = shape(geojson_object['geometry'])
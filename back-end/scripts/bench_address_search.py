@@ -0,0 +1,60 @@
+"""Address search latency micro-benchmark.
+
+Times fabric_ops.address_query, the query behind the map's search bar, over a set of typed-as-you-go
+queries and reports p50/p99. By default it seeds a state-sized synthetic fabric in a transaction that is
+rolled back afterwards; --folder-id benchmarks an existing filing instead. Run from back-end/:
+
+    python -m scripts.bench_address_search --rows 3500000
+"""
+import argparse, time, statistics
+from database.sessions import Session
+from controllers.database_controller.fabric_ops import address_query
+from scripts.synthetic_fabric import seed_folder, STREET_NAMES, CITIES
+
+def build_queries():
+    # Prefixes of a few full queries, the way the search bar sends them while the user types
+    full_queries = [f'{n * 37 % 9999 + 1} {STREET_NAMES[n % len(STREET_NAMES)]} {CITIES[n % len(CITIES)]} VA' for n in range(10)]
+    full_queries += ['MAPLE', 'RIDGE RD', '404 NOWHERE']
+    queries = []
+    for full_query in full_queries:
+        queries += [full_query[:end] for end in range(3, len(full_query) + 1, 3)] + [full_query]
+    return queries
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=3500000, help='synthetic fabric locations to seed')
+    parser.add_argument('--folder-id', type=int, help='benchmark an existing folder instead of seeding one')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the query set')
+    args = parser.parse_args()
+
+    session = Session()
+    try:
+        folderid = args.folder_id
+        if folderid is None:
+            start = time.perf_counter()
+            folderid = seed_folder(session, args.rows)
+            print(f"Seeded {args.rows} fabric rows in {time.perf_counter() - start:.1f}s")
+
+        queries = build_queries()
+        for query in queries[:len(queries) // 4]:
+            address_query(folderid, query, session)
+
+        samples = []
+        for _ in range(args.repeat):
+            for query in queries:
+                start = time.perf_counter()
+                address_query(folderid, query, session)
+                samples.append((time.perf_counter() - start) * 1000)
+
+        print(f"{len(samples)} queries: p50 {percentile(samples, 0.5):.1f} ms, p99 {percentile(samples, 0.99):.1f} ms, "
+              f"mean {statistics.mean(samples):.1f} ms, max {max(samples):.1f} ms")
+    finally:
+        session.rollback()
+        session.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Folder delete benchmark.
+
+Seeds a synthetic filing with N fabric locations and M coverage rows and times the statement behind
+celery_tasks.async_folder_delete, whose files, fabric and coverage rows go with the folder through
+ON DELETE CASCADE. Everything runs in a transaction that is rolled back afterwards. Run from back-end/:
+
+    python -m scripts.bench_folder_delete --fabric-rows 1000000 --kml-rows 500000
+"""
+import argparse, time
+from sqlalchemy import text
+from database.sessions import Session
+from scripts.synthetic_fabric import seed_folder
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fabric-rows', type=int, default=1000000, help='synthetic fabric locations to seed')
+    parser.add_argument('--kml-rows', type=int, default=500000, help='coverage rows to seed, at most --fabric-rows')
+    args = parser.parse_args()
+
+    session = Session()
+    try:
+        start = time.perf_counter()
+        folderid = seed_folder(session, args.fabric_rows, min(args.kml_rows, args.fabric_rows))
+        print(f"Seeded {args.fabric_rows} fabric and {min(args.kml_rows, args.fabric_rows)} coverage rows "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        session.execute(text('DELETE FROM folder WHERE id = :folderid'), {'folderid': folderid})
+        print(f"Deleted the folder in {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        session.rollback()
+        session.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Loss filter benchmark.
+
+Times rasterprocessing.filter_image_by_loss, which drops the pixels of a SignalServer coverage PNG whose loss rate
+is above the floor, against the per-pixel loop it replaced, on a synthetic raster and .lcf mapping, and checks that
+both produce the same image. The legacy loop takes minutes at full size; --legacy-columns times it on the first
+columns only and extrapolates. Run from back-end/:
+
+    python -m scripts.bench_loss_filter --size 3600
+"""
+import argparse, os, time, shutil, tempfile
+import numpy as np
+from PIL import Image
+from controllers.signalserver_controller.rasterprocessing import filter_image_by_loss, load_loss_to_color_mapping
+
+def legacy_filter_image_by_loss(input_image_path, floor_loss_rate, lcf_file_path, output_image_path, columns=None):
+    # The per-pixel implementation filter_image_by_loss replaced, limited to the first columns when given
+    loss_to_color_mapping = load_loss_to_color_mapping(lcf_file_path, floor_loss_rate)
+    with Image.open(input_image_path) as img:
+        img = img.convert('RGBA')
+        pixels = img.load()
+
+        for i in range(img.width if columns is None else min(columns, img.width)):
+            for j in range(img.height):
+                r, g, b, a = pixels[i, j]
+                loss_rate = next((loss for loss, color in loss_to_color_mapping.items() if color == (r, g, b)), None)
+                if loss_rate is None or loss_rate > floor_loss_rate:
+                    pixels[i, j] = (255, 255, 255, 0)
+
+        img.save(output_image_path, 'PNG')
+
+def write_synthetic_inputs(workdir, size, min_loss, max_loss):
+    # One color per loss rate, like SignalServer's .lcf, and a raster of rings of increasing loss around the
+    # transmitter with some pixels of colors the mapping does not have
+    losses = np.arange(min_loss, max_loss + 1)
+    colors = np.stack([255 - (losses - min_loss) * 255 // max(max_loss - min_loss, 1),
+                       (losses * 37) % 256, (losses * 91) % 256], axis=-1).astype(np.uint8)
+    lcf_path = os.path.join(workdir, 'synthetic.lcf')
+    with open(lcf_path, 'w') as lcf:
+        lcf.writelines(f"{loss}: {r},{g},{b}\n" for loss, (r, g, b) in zip(losses, colors))
+
+    rng = np.random.default_rng(0)
+    y, x = np.ogrid[:size, :size]
+    distance = np.hypot(x - size / 2, y - size / 2) / (size / 2)
+    index = np.clip((distance * len(losses)).astype(int) + rng.integers(-3, 4, (size, size)), 0, len(losses) - 1)
+    rgba = np.empty((size, size, 4), dtype=np.uint8)
+    rgba[..., :3] = colors[index]
+    rgba[..., 3] = 255
+    rgba[rng.random((size, size)) < 0.05] = (255, 255, 255, 255)
+
+    png_path = os.path.join(workdir, 'synthetic.png')
+    Image.fromarray(rgba, 'RGBA').save(png_path, 'PNG')
+    return png_path, lcf_path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=3600, help='raster width and height in pixels')
+    parser.add_argument('--floor-loss-rate', type=int, default=140, help='highest loss rate kept')
+    parser.add_argument('--legacy-columns', type=int, help='time the legacy loop on this many columns and extrapolate')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        png_path, lcf_path = write_synthetic_inputs(workdir, args.size, 80, 200)
+        # Both implementations truncate the .lcf to the floor loss rate, so each gets its own copy
+        legacy_lcf_path = os.path.join(workdir, 'legacy.lcf')
+        shutil.copyfile(lcf_path, legacy_lcf_path)
+
+        start = time.perf_counter()
+        filter_image_by_loss(png_path, args.floor_loss_rate, lcf_path, os.path.join(workdir, 'vectorized.png'))
+        vectorized = time.perf_counter() - start
+        print(f"vectorized: {vectorized:.2f}s for {args.size}x{args.size}")
+
+        columns = args.legacy_columns
+        start = time.perf_counter()
+        legacy_filter_image_by_loss(png_path, args.floor_loss_rate, legacy_lcf_path, os.path.join(workdir, 'legacy.png'), columns)
+        legacy = time.perf_counter() - start
+        if columns is not None and columns < args.size:
+            legacy = legacy * args.size / columns
+            print(f"legacy:     {legacy:.2f}s, extrapolated from {columns} columns")
+        else:
+            print(f"legacy:     {legacy:.2f}s")
+        print(f"speedup:    {legacy / vectorized:.0f}x")
+
+        with Image.open(os.path.join(workdir, 'vectorized.png')) as img:
+            vectorized_pixels = np.array(img.convert('RGBA'))
+        with Image.open(os.path.join(workdir, 'legacy.png')) as img:
+            legacy_pixels = np.array(img.convert('RGBA'))
+        compared = slice(None) if columns is None else slice(0, columns)
+        same = np.array_equal(vectorized_pixels[:, compared], legacy_pixels[:, compared])
+        print(f"outputs {'match' if same else 'DIFFER'}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
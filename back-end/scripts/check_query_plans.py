@@ -0,0 +1,70 @@
+"""Query plan regression check for the lookup indexes.
+
+EXPLAINs the hot lookups against the configured database and fails when one of them no longer uses its
+index. Sequential scans are disabled for the check, so it also passes on small or empty tables where the
+planner would rather scan. Run from back-end/ with the app's environment:
+
+    python -m scripts.check_query_plans
+"""
+import sys, json
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from database.sessions import Session
+from database.models import file, kml_data, fabric_data, vector_tiles
+
+def plan_index_names(plan):
+    names = {plan['Index Name']} if 'Index Name' in plan else set()
+    for child in plan.get('Plans', []):
+        names |= plan_index_names(child)
+    return names
+
+def explain(query, session):
+    sql = str(query.statement.compile(dialect=postgresql.dialect(paramstyle='named'), compile_kwargs={'literal_binds': True}))
+    plan = session.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+def get_checks(session):
+    # (description, query, index the query must use), mirroring the lookups in the ops modules
+    return [
+        ('tile by address (tile_store.PostgresTileStore.get_tile)',
+         session.query(vector_tiles.tile_data).filter(vector_tiles.mbtiles_id == 1, vector_tiles.zoom_level == 10,
+                                                      vector_tiles.tile_column == 285, vector_tiles.tile_row == 630),
+         'ix_vector_tiles_mbtiles_id_zoom_level_tile_column_tile_row'),
+        ('coverage rows of a file (kml_ops.iter_kml_data)',
+         session.query(kml_data).filter(kml_data.file_id.in_([1, 2])),
+         'ix_kml_data_file_id_location_id'),
+        ('edited coverage rows (celery_tasks.toggle_tiles)',
+         session.query(kml_data).join(file).filter(kml_data.location_id == 1000, file.folder_id == 1, file.name == 'coverage.kml'),
+         'ix_kml_data_file_id_location_id'),
+        ('fabric rows of a file (kml_ops.iter_kml_data)',
+         session.query(fabric_data).filter(fabric_data.file_id.in_([1])),
+         'ix_fabric_data_file_id_location_id'),
+        ('files of a folder (file_ops.get_files_with_postfix)',
+         session.query(file.id).filter(file.folder_id == 1, file.name.endswith('.kml')),
+         'ix_file_folder_id_name'),
+        ('address search (fabric_ops.address_query)',
+         session.query(fabric_data.location_id).filter(fabric_data.address_primary.ilike('%123 main%')),
+         'ix_fabric_data_address_primary_trgm'),
+    ]
+
+def main():
+    session = Session()
+    failures = 0
+    try:
+        session.execute(text('SET LOCAL enable_seqscan = off'))
+        for description, query, index_name in get_checks(session):
+            used = plan_index_names(explain(query, session))
+            if index_name in used:
+                print(f"ok    {description}: {index_name}")
+            else:
+                failures += 1
+                print(f"FAIL  {description}: expected {index_name}, plan uses {sorted(used) or 'no index'}")
+    finally:
+        session.rollback()
+        session.close()
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
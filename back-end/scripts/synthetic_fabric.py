@@ -0,0 +1,55 @@
+"""Synthetic filings for the benchmark scripts, generated inside Postgres with generate_series."""
+from sqlalchemy import text
+
+STREET_NAMES = ['MAIN', 'OAK', 'PINE', 'MAPLE', 'CEDAR', 'ELM', 'WASHINGTON', 'LAKE', 'HILL', 'PARK',
+                'CHURCH', 'SPRING', 'MILL', 'RIDGE', 'FOREST', 'VALLEY', 'JEFFERSON', 'MADISON', 'LINCOLN', 'JACKSON']
+STREET_SUFFIXES = ['ST', 'AVE', 'RD', 'DR', 'LN', 'CT', 'WAY', 'PL', 'BLVD', 'TRL']
+CITIES = ['BLACKSBURG', 'ROANOKE', 'RICHMOND', 'NORFOLK', 'ARLINGTON', 'LYNCHBURG', 'SALEM', 'DANVILLE',
+          'CHARLOTTESVILLE', 'HARRISONBURG', 'WINCHESTER', 'STAUNTON', 'BRISTOL', 'RADFORD', 'PULASKI', 'WYTHEVILLE']
+
+def sql_array(values):
+    return 'ARRAY[' + ', '.join(f"'{value}'" for value in values) + ']'
+
+def seed_folder(session, fabric_rows, kml_rows=0, state='VA'):
+    # Creates a folder with one fabric file of fabric_rows locations and, with kml_rows, one coverage file serving
+    # the first kml_rows of them. Returns the folder id; nothing is committed
+    folderid = session.execute(text(
+        "INSERT INTO folder (name, type) VALUES ('benchmark', 'upload') RETURNING id")).scalar_one()
+    fabric_file_id = session.execute(text(
+        "INSERT INTO file (name, folder_id, timestamp, type, computed) "
+        "VALUES ('benchmark-fabric.csv', :folderid, now(), 'fabric', true) RETURNING id"), {'folderid': folderid}).scalar_one()
+
+    session.execute(text(f"""
+        INSERT INTO fabric_data (location_id, address_primary, city, state, zip_code, unit_count, bsl_flag,
+                                 latitude, longitude, file_id)
+        SELECT g,
+               (g % 9999 + 1) || ' ' || ({sql_array(STREET_NAMES)})[(g / 9999) % {len(STREET_NAMES)} + 1] || ' '
+                   || ({sql_array(STREET_SUFFIXES)})[(g / 199980) % {len(STREET_SUFFIXES)} + 1],
+               ({sql_array(CITIES)})[g % {len(CITIES)} + 1],
+               :state,
+               lpad((22000 + g % 2000)::text, 5, '0'),
+               1,
+               'True',
+               36.5 + random() * 3,
+               -83.5 + random() * 8,
+               :fileid
+        FROM generate_series(1, :rows) AS g
+        """), {'state': state, 'fileid': fabric_file_id, 'rows': fabric_rows})
+
+    if kml_rows:
+        coverage_file_id = session.execute(text(
+            "INSERT INTO file (name, folder_id, timestamp, type, computed) "
+            "VALUES ('benchmark-coverage.kml', :folderid, now(), 'wired', true) RETURNING id"), {'folderid': folderid}).scalar_one()
+        session.execute(text("""
+            INSERT INTO kml_data (location_id, served, wireless, lte, "coveredLocations", "maxDownloadNetwork",
+                                  "maxDownloadSpeed", "maxUploadSpeed", "techType", address_primary, longitude, latitude,
+                                  latency, category, file_id)
+            SELECT location_id, true, false, false, 'benchmark-coverage.kml', 'benchmark-coverage.kml',
+                   100, 20, 50, address_primary, longitude, latitude, 1, 'X', :fileid
+            FROM fabric_data
+            WHERE file_id = :fabric_file_id AND location_id <= :rows
+            """), {'fileid': coverage_file_id, 'fabric_file_id': fabric_file_id, 'rows': kml_rows})
+
+    session.execute(text('ANALYZE fabric_data'))
+    session.execute(text('ANALYZE kml_data'))
+    return folderid
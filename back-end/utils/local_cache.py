@@ -0,0 +1,135 @@
+import json, time
+from collections import OrderedDict
+from threading import Lock, Thread
+from sqlalchemy import event
+from utils.config import Config
+from utils.logger_config import logger
+
+MISSING = object()
+
+INVALIDATION_CHANNEL = 'bdk:cache-invalidation'
+INVALIDATION_RETRY_DELAY = 5  # seconds
+
+class LRUCache:
+    """Thread-safe in-process LRU bounded by entry count and/or total size, with an optional TTL."""
+
+    def __init__(self, max_entries=None, max_size=None, ttl=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, size, stored_at)
+        self.size = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            if self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                return MISSING
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.max_size is not None and value is not None else 0
+        if self.max_size is not None and size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, time.monotonic())
+            self.size += size
+            while ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                   (self.max_size is not None and self.size > self.max_size)):
+                self._remove(next(iter(self.entries)))
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def discard_where(self, predicate):
+        with self.lock:
+            for key in [key for key in self.entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+
+# Caches live per process, but tilesets and memberships change in Celery workers as well as in the web app,
+# so invalidations are applied locally and fanned out to every other process over Redis pub/sub
+invalidation_handlers = {}
+listener_lock = Lock()
+listener_started = False
+redis_client = None
+
+def register_invalidation_handler(topic, handler):
+    # handler(key) drops cached state for key; key None means drop everything
+    invalidation_handlers.setdefault(topic, []).append(handler)
+
+def apply_invalidation(topic, key):
+    for handler in invalidation_handlers.get(topic, []):
+        handler(key)
+
+def get_redis_client():
+    global redis_client
+    url = Config.CELERY_BROKER_URL
+    if not url or not url.startswith(('redis://', 'rediss://', 'unix://')):
+        return None
+    if redis_client is None:
+        import redis
+        redis_client = redis.Redis.from_url(url)
+    return redis_client
+
+def publish_invalidation(topic, key):
+    apply_invalidation(topic, key)
+    try:
+        client = get_redis_client()
+        if client is not None:
+            client.publish(INVALIDATION_CHANNEL, json.dumps({'topic': topic, 'key': key}))
+    except Exception as e:
+        logger.warning(f"Could not publish {topic} cache invalidation for {key}: {e}")
+
+def publish_invalidation_after_commit(session, topic, key):
+    # Publishes once the session's transaction is committed, so no process reloads the state being replaced before
+    # the change is visible. After a rollback it waits for the session's next commit, where it is merely redundant
+    event.listen(session, 'after_commit', lambda session: publish_invalidation(topic, key), once=True)
+
+def listen_for_invalidations(client):
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything could have changed while we were not subscribed
+            for topic in list(invalidation_handlers):
+                apply_invalidation(topic, None)
+            for message in pubsub.listen():
+                # Our own messages come back too; dropping the same entries twice is harmless
+                payload = json.loads(message['data'])
+                apply_invalidation(payload['topic'], payload['key'])
+        except Exception as e:
+            logger.warning(f"Cache invalidation listener disconnected: {e}")
+            time.sleep(INVALIDATION_RETRY_DELAY)
+
+def start_invalidation_listener():
+    global listener_started
+    with listener_lock:
+        if listener_started:
+            return
+        listener_started = True
+
+    client = get_redis_client()
+    if client is None:
+        logger.warning("No Redis broker configured, in-process caches rely on their TTL for invalidation")
+        return
+    Thread(target=listen_for_invalidations, args=(client,), name='cache-invalidation', daemon=True).start()
@@ -16,7 +16,52 @@ DATABASE_URL = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_na
 
 
 BATCH_SIZE = 50000
+
+# Fabric GeoDataFrames kept in memory per worker process for coverage computation
+FABRIC_CACHE_MAX_ENTRIES = int(os.getenv('FABRIC_CACHE_MAX_ENTRIES', 4))
+FABRIC_CACHE_MAX_ROWS = int(os.getenv('FABRIC_CACHE_MAX_ROWS', 10000000))
+# Typed columnar copies of the fabric uploads, shared by the workers; 'uncompressed' lets them be memory-mapped without copying
+FABRIC_ARTIFACT_DIR = os.getenv('FABRIC_ARTIFACT_DIR', os.path.join(os.getcwd(), 'fabric-artifacts'))
+FABRIC_ARTIFACT_COMPRESSION = os.getenv('FABRIC_ARTIFACT_COMPRESSION', 'uncompressed')
 COOKIE_EXP_TIME = timedelta(days=7)  # Cookie will expire in 7 days
 
+# Largest page of locations /api/served-data returns per request
+SERVED_DATA_MAX_PAGE_SIZE = int(os.getenv('SERVED_DATA_MAX_PAGE_SIZE', 50000))
+
+# In-process caches used to serve vector tiles without database round trips
+TILE_CACHE_MAX_BYTES = int(os.getenv('TILE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+TILE_CACHE_MAX_ENTRIES = int(os.getenv('TILE_CACHE_MAX_ENTRIES', 200000))
+TILESET_CACHE_TTL = int(os.getenv('TILESET_CACHE_TTL', 60))  # seconds
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 60))  # seconds
+
+# Where new tilesets are stored: 'postgres' stores every tile as a vector_tiles row; 'mbtiles' keeps them as files
+# under TILESET_DIR, which must then be one volume mounted by the web app and every worker (e.g. an NFS mount),
+# since the production web app and workers are separate deployments that share nothing but the database
+TILE_STORE_BACKEND = os.getenv('TILE_STORE_BACKEND', 'postgres')
+TILESET_DIR = os.getenv('TILESET_DIR', os.path.join(os.getcwd(), 'tilesets'))
+TILESET_CONNECTION_POOL_SIZE = int(os.getenv('TILESET_CONNECTION_POOL_SIZE', 32))
+TILESET_MMAP_SIZE = int(os.getenv('TILESET_MMAP_SIZE', 256 * 1024 * 1024))
+TILESET_PRUNE_GRACE = int(os.getenv('TILESET_PRUNE_GRACE', 3600))  # seconds
+
+# Uploads and generated files handed to Celery tasks by reference are staged in the database and pruned after this
+STAGED_BLOB_TTL = int(os.getenv('STAGED_BLOB_TTL', 7 * 24 * 3600))  # seconds
+# Largest chunk accepted by the chunked upload endpoints
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+# Largest file accepted for upload, and most bytes a user may have staged at once
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 2 * 1024 * 1024 * 1024))
+UPLOAD_USER_QUOTA = int(os.getenv('UPLOAD_USER_QUOTA', 10 * 1024 * 1024 * 1024))
+
+# Per-file layer tilesets kept by the workers so unchanged files are not retiled
+TILE_LAYER_CACHE_DIR = os.getenv('TILE_LAYER_CACHE_DIR', os.path.join(os.getcwd(), 'tile-layers'))
+TILE_LAYER_CACHE_MAX_FILES = int(os.getenv('TILE_LAYER_CACHE_MAX_FILES', 1000))
+# Scratch space for tippecanoe's temporary files and output; point it at a tmpfs mount to keep tiling off the container disk
+TILE_WORK_DIR = os.getenv('TILE_WORK_DIR', TILE_LAYER_CACHE_DIR)
+# Zoom levels retiled per tippecanoe run after a map edit; wider bands mean fewer runs but more tiles per run
+TILE_EDIT_ZOOM_BAND = int(os.getenv('TILE_EDIT_ZOOM_BAND', 3))
+
+# Morphological smoothing applied to wireless prediction rasters before vectorizing
+RASTER_SMOOTHING_ITERATIONS = int(os.getenv('RASTER_SMOOTHING_ITERATIONS', 2))
+RASTER_SMOOTHING_KERNEL_RADIUS = int(os.getenv('RASTER_SMOOTHING_KERNEL_RADIUS', 1))
+
 
 
@@ -10,4 +10,3 @@ wireless_formfield2args = {
 }
 
 wireless_raster_file_format = ['.kmz', '.lcf', '.png', '.ppm']
-wireless_vector_file_format = ['.kml', '.png', '.tif']
\ No newline at end of file
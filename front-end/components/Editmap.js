@@ -432,29 +432,42 @@ function Editmap() {
   const fetchMarkers = () => {
 
     setIsLoadingForUntimedEffect(true);
-    const url = `${backend_url}/api/served-data/${folderID}`
-
-
-    return fetch(url, {
-      method: "GET",
-      credentials: "include",
-    })
-      .then((response) => {
-        if (response.status === 401) {
-          Swal.fire({
-            icon: "error",
-            title: "Oops...",
-            text: "Session expired, please log in again!",
-          });
-          // Redirect to login page
-          router.push("/login");
-          setIsLoading(false);
-          return;
-        }
-        else if (response.status === 200) {
-          return response.json();
-        }
+    const fields = "location_id,address,latitude,longitude,served,coveredLocations";
+    const pageSize = 50000;
+
+    // Locations are fetched page by page, each page starting after the last location id of the previous one
+    const fetchPage = (cursor, rows) => {
+      const url = `${backend_url}/api/served-data/${folderID}?fields=${fields}&limit=${pageSize}` + (cursor !== null ? `&cursor=${cursor}` : "");
+      return fetch(url, {
+        method: "GET",
+        credentials: "include",
       })
+        .then((response) => {
+          if (response.status === 401) {
+            Swal.fire({
+              icon: "error",
+              title: "Oops...",
+              text: "Session expired, please log in again!",
+            });
+            // Redirect to login page
+            router.push("/login");
+            setIsLoading(false);
+            return;
+          }
+          else if (response.status === 200) {
+            return response.json();
+          }
+        })
+        .then((page) => {
+          if (!page) {
+            return;
+          }
+          page.data.forEach((row) => rows.push(row));
+          return page.next_cursor !== null ? fetchPage(page.next_cursor, rows) : rows;
+        });
+    };
+
+    return fetchPage(null, [])
       .then((data) => {
         const newMarkers = data.map((item) => ({
           address: item.address,
@@ -264,7 +264,70 @@ export default function Upload() {
         return errorRows.has(params.id) ? 'error-row' : 'normal-row';
     };
 
-    const processFiles = () => {
+    // Files larger than this are sent through the resumable chunked upload endpoints
+    const chunkedUploadThreshold = 8 * 1024 * 1024;
+
+    const uploadRequest = async (url, options) => {
+        const response = await fetch(url, { credentials: "include", ...options });
+        if (response.status === 401) {
+            throw new Error("unauthorized");
+        }
+        return { status: response.status, data: await response.json() };
+    };
+
+    const uploadInChunks = async (file) => {
+        const created = await uploadRequest(`${backend_url}/api/uploads`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ name: file.name, size: file.size }),
+        });
+        if (created.data.status !== "success") {
+            throw new Error(created.data.message);
+        }
+        const { upload_id: uploadId, chunk_size: chunkSize } = created.data;
+
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            const chunk = await file.slice(offset, offset + chunkSize).arrayBuffer();
+            const digest = await crypto.subtle.digest("SHA-256", chunk);
+            const sha256 = Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, "0")).join("");
+            try {
+                const result = await uploadRequest(`${backend_url}/api/uploads/${uploadId}?offset=${offset}`, {
+                    method: "PUT",
+                    headers: { "Content-Type": "application/octet-stream", "X-Chunk-Sha256": sha256 },
+                    body: chunk,
+                });
+                if (result.status === 409) {
+                    offset = result.data.offset;
+                } else if (result.data.status === "success") {
+                    offset = result.data.offset;
+                    retries = 0;
+                } else {
+                    throw new Error(result.data.message);
+                }
+            } catch (error) {
+                if (error.message === "unauthorized" || retries >= 5) {
+                    throw error;
+                }
+                // Resume from wherever the server got to before the interruption
+                retries += 1;
+                await new Promise((resolve) => setTimeout(resolve, 1000 * retries));
+                const current = await uploadRequest(`${backend_url}/api/uploads/${uploadId}`, { method: "GET" });
+                if (current.data.status === "success") {
+                    offset = current.data.offset;
+                }
+            }
+        }
+
+        const completed = await uploadRequest(`${backend_url}/api/uploads/${uploadId}/complete`, { method: "POST" });
+        if (completed.data.status !== "success") {
+            throw new Error(completed.data.message);
+        }
+        return uploadId;
+    };
+
+    const processFiles = async () => {
 
         if (files.length === 0) {
             toast.error("Please upload your file");
@@ -306,6 +369,27 @@ export default function Upload() {
         formData.append("importFolder", importFolderID);
 
 
+        const uploadIds = {};
+        try {
+            for (const fileDetails of files) {
+                if (fileDetails.file.size > chunkedUploadThreshold) {
+                    uploadIds[fileDetails.id] = await uploadInChunks(fileDetails.file);
+                }
+            }
+        } catch (error) {
+            if (error.message === "unauthorized") {
+                Swal.fire({
+                    icon: "error",
+                    title: "Oops...",
+                    text: "Session expired, please log in again!",
+                });
+                router.push("/login");
+            } else {
+                toast.error(`Upload failed: ${error.message}`);
+            }
+            return;
+        }
+
         files.forEach((fileDetails) => {
             const fileExtension = fileDetails.file.name
                 .split(".")
@@ -322,12 +406,15 @@ export default function Upload() {
                 techType: tech_types[fileDetails.techType],
                 latency: latency_type[fileDetails.latency],
                 categoryCode: bus_codes[fileDetails.categoryCode],
+                uploadId: uploadIds[fileDetails.id],
             };
 
             console.log(processedFileDetails);
     
             formData.append("fileData", JSON.stringify(processedFileDetails));
-            formData.append("file", fileDetails.file);
+            if (!processedFileDetails.uploadId) {
+                formData.append("file", fileDetails.file);
+            }
         });
 
 
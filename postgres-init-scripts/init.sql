@@ -1,2 +1,3 @@
 CREATE EXTENSION postgis;
-CREATE EXTENSION postgis_topology;
\ No newline at end of file
+CREATE EXTENSION postgis_topology;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
\ No newline at end of file